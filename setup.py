@@ -2,8 +2,8 @@
 from setuptools import setup
 import sys
 
-if sys.version_info < (3,2):
-    sys.stdout.write("At least Python 3.2 is required.\n")
+if sys.version_info < (3,3):
+    sys.stdout.write("At least Python 3.3 is required.\n")
     sys.exit(1)
 
 from snakemake import __version__, get_argument_parser
@@ -10,10 +10,13 @@ import multiprocessing
 import re
 import sys
 import inspect
+import pickle
 from functools import partial
 
 
 from snakemake.workflow import Workflow
+from snakemake.executors import run_wrapper
+from snakemake.io import IOFile
 from snakemake.exceptions import print_exception
 from snakemake.logging import logger, init_logger
 
@@ -61,6 +64,16 @@ def snakemake(snakefile,
     debug=False,
     notemp=False,
     nodeps=False,
+    dag_cache=False,
+    coalesce_window=0,
+    backfill=False,
+    mem_budget=None,
+    io_budget=None,
+    warm_workers=False,
+    max_jobs_per_worker=None,
+    async_shell=False,
+    cluster_notify=False,
+    cluster_array=None,
     jobscript=None,
     timestamp=False):
     """
@@ -79,6 +92,25 @@ def snakemake(snakefile,
     forceall          -- force all rules to be executed
     time_measurements -- measure the running times of all rules
     lock              -- lock the working directory
+    dag_cache         -- cache the DAG in the .snakemake directory
+    coalesce_window   -- seconds to wait for further finishing jobs before
+        selecting new ones
+    backfill          -- reserve resources for blocked jobs and only start
+        other jobs that do not delay them
+    mem_budget        -- megabytes of memory that running jobs may use
+        according to their peak memory in previous runs
+    io_budget         -- megabytes per second that running jobs may read and
+        write according to previous runs
+    warm_workers      -- execute run methods in persistent worker processes
+        that import the modules to preload only once
+    max_jobs_per_worker -- replace warm workers after the given number of jobs
+    async_shell       -- spawn the commands of shell rules directly on an
+        event loop instead of in the process pool
+    cluster_notify    -- let cluster jobs notify about their completion via
+        a socket instead of only scanning for their marker files
+    cluster_array     -- submit cluster jobs of the same rule and resources
+        that are selected together as array jobs, the given environment
+        variable holds the task index
     """
 
     init_logger(nocolor=nocolor, stdout=dryrun, debug=debug, timestamp=timestamp)
@@ -138,6 +170,16 @@ def snakemake(snakefile,
                         debug=debug,
                         notemp=notemp,
                         nodeps=nodeps,
+                        dag_cache=dag_cache,
+                        coalesce_window=coalesce_window,
+                        backfill=backfill,
+                        mem_budget=mem_budget,
+                        io_budget=io_budget,
+                        warm_workers=warm_workers,
+                        max_jobs_per_worker=max_jobs_per_worker,
+                        async_shell=async_shell,
+                        cluster_notify=cluster_notify,
+                        cluster_array=cluster_array,
                         jobscript=jobscript,
                         timestamp=timestamp)
                     for subworkflow in workflow.subworkflows:
@@ -171,6 +213,16 @@ def snakemake(snakefile,
                         resources=resources,
                         notemp=notemp,
                         nodeps=nodeps,
+                        dag_cache=dag_cache,
+                        coalesce_window=coalesce_window,
+                        backfill=backfill,
+                        mem_budget=mem_budget,
+                        io_budget=io_budget,
+                        warm_workers=warm_workers,
+                        max_jobs_per_worker=max_jobs_per_worker,
+                        async_shell=async_shell,
+                        cluster_notify=cluster_notify,
+                        cluster_array=cluster_array,
                         cleanup_metadata=cleanup_metadata
                         )
 
@@ -205,6 +257,52 @@ def parse_resources(args):
     return resources
 
 
+def execute_job(payload, snakemakepath=None, nocolor=False, debug=False,
+    timestamp=False):
+    """
+    Execute a single job, as described by the given payload file written by
+    the cluster executor. The Snakefile is only parsed in order to obtain the
+    run method of the rule, no DAG is built.
+
+    Arguments
+    payload -- path to the payload file
+    """
+    init_logger(nocolor=nocolor, debug=debug, timestamp=timestamp)
+
+    try:
+        with open(payload, "rb") as f:
+            job = pickle.load(f)
+    except (IOError, pickle.UnpicklingError) as e:
+        logger.error("Error: failed to load job payload {}: {}".format(
+            payload, e))
+        return False
+
+    workflow = Workflow(
+        snakefile=job["snakefile"], snakemakepath=snakemakepath)
+    output = list()
+    try:
+        # like --directory, this suppresses the workdir directive
+        workflow.include(
+            job["snakefile"], workdir=job["workdir"], overwrite_first_rule=True)
+        rule = workflow.get_rule(job["rule"])
+        output = [IOFile(f, rule=rule) for f in job["output"]]
+        for f in output:
+            f.prepare()
+        if job["log"] is not None:
+            IOFile(job["log"], rule=rule).prepare()
+        run_wrapper(
+            rule.run_func, job["input"], job["output"], job["params"],
+            job["wildcards"], job["threads"], job["resources"], job["log"],
+            workflow.linemaps)
+    except BaseException as ex:
+        print_exception(ex, workflow.linemaps)
+        for f in output:
+            if f.exists:
+                f.remove()
+        return False
+    return True
+
+
 def get_argument_parser():
     parser = argparse.ArgumentParser(
         description="Snakemake is a Python based language and execution "
@@ -389,6 +487,65 @@ def get_argument_parser():
         "a part of the workflow, since temp() would lead to deletion of "
         "probably needed files by other parts of the workflow."
         )
+    parser.add_argument(
+        "--dag-cache", action="store_true",
+        help="Cache the DAG in the .snakemake directory. Subsequent "
+        "invocations with the same Snakefile and targets load the cached "
+        "DAG instead of building it again, as long as it is still valid.")
+    parser.add_argument(
+        "--coalesce-window", type=float, default=0, metavar="SECONDS",
+        help="Wait given seconds after a job has finished before selecting "
+        "new jobs, such that jobs finishing in the meantime are handled "
+        "together. This reduces the scheduling overhead for many short "
+        "jobs.")
+    parser.add_argument(
+        "--backfill", action="store_true",
+        help="Reserve resources for the most important job that does not "
+        "fit into the free resources, and only start other jobs if they are "
+        "expected to finish before the reservation (according to the "
+        "runtimes of previous runs) or do not need the reserved resources. "
+        "This prevents jobs with many threads from being starved by "
+        "single-threaded jobs.")
+    parser.add_argument(
+        "--mem-budget", type=int, metavar="MB",
+        help="Only run jobs together if their peak memory (as measured "
+        "for jobs of the same rule in previous runs) fits into the given "
+        "megabytes.")
+    parser.add_argument(
+        "--io-budget", type=int, metavar="MB/S",
+        help="Only run jobs together if the bandwidth they read and write "
+        "with (as measured for jobs of the same rule in previous runs) fits "
+        "into the given megabytes per second.")
+    parser.add_argument(
+        "--warm-workers", action="store_true",
+        help="Execute the run blocks of rules in persistent worker "
+        "processes. Modules listed with the preload keyword (in the "
+        "Snakefile or in a rule) are imported only once per worker, and jobs "
+        "of a rule preferably run in a worker that already executed the "
+        "rule.")
+    parser.add_argument(
+        "--max-jobs-per-worker", type=int, metavar="N",
+        help="Replace a warm worker process after it executed the given "
+        "number of jobs (e.g. to release leaked memory).")
+    parser.add_argument(
+        "--async-shell", action="store_true",
+        help="Spawn the commands of shell rules directly as subprocesses "
+        "on an event loop instead of running them in the process pool "
+        "(POSIX only).")
+    parser.add_argument(
+        "--cluster-notify", action="store_true",
+        help="Open a socket to which cluster jobs report their completion, "
+        "such that the directory with the jobscripts needs to be scanned "
+        "for finished jobs less often. The jobscript has to contain the "
+        "{notify} placeholder and needs to be executed with bash.")
+    parser.add_argument(
+        "--cluster-array", metavar="VAR",
+        help="Submit the cluster jobs of the same rule that need the same "
+        "resources and are selected together as one array job. VAR is the "
+        "environment variable that holds the index (starting at 1) of the "
+        "task in the array job, e.g. SGE_TASK_ID. The number of tasks is "
+        "available as {tasks} in the submit command, e.g. "
+        "--cluster 'qsub -t 1-{tasks}'.")
     parser.add_argument(
         '--timestamp', '-T', action='store_true',
         help='Add a timestamp to all logging output')
@@ -397,6 +554,11 @@ def get_argument_parser():
         help="Print the python representation of the workflow.")
     parser.add_argument(
         "--debug", action="store_true", help="Print debugging output.")
+    parser.add_argument(
+        "--execute-job", metavar="PAYLOAD",
+        help="Execute a single job as described by the given payload file "
+        "that is written next to the jobscript of a cluster job, without "
+        "building the DAG. This is used by the default jobscript.")
     parser.add_argument(
             "--bash-completion", action="store_true", help="Output code to register bash completion for snakemake. Put the following in your .bashrc (including the accents): `snakemake --bash-completion`")
     parser.add_argument(
@@ -418,6 +580,12 @@ def main():
 
     snakemakepath = get_snakemake_path()
 
+    if args.execute_job:
+        success = execute_job(
+            args.execute_job, snakemakepath=snakemakepath,
+            nocolor=args.nocolor, debug=args.debug, timestamp=args.timestamp)
+        sys.exit(0 if success else 1)
+
     try:
         resources = parse_resources(args)
     except ValueError as e:
@@ -466,6 +634,16 @@ def main():
             debug=args.debug,
             jobscript=args.jobscript,
             notemp=args.notemp,
+            dag_cache=args.dag_cache,
+            coalesce_window=args.coalesce_window,
+            backfill=args.backfill,
+            mem_budget=args.mem_budget,
+            io_budget=args.io_budget,
+            warm_workers=args.warm_workers,
+            max_jobs_per_worker=args.max_jobs_per_worker,
+            async_shell=args.async_shell,
+            cluster_notify=args.cluster_notify,
+            cluster_array=args.cluster_array,
             timestamp=args.timestamp)
     sys.exit(0 if success else 1)
 
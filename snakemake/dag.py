@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
 
+import os
 import textwrap
 import time
-from collections import defaultdict, Counter
+import hashlib
+import marshal
+import math
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, Counter, deque, OrderedDict
 from itertools import chain, combinations, filterfalse, product, groupby
-from functools import partial, lru_cache
+from functools import partial, lru_cache, cmp_to_key
 from operator import itemgetter, attrgetter
 
-from snakemake.io import IOFile, _IOFile
+from snakemake.io import IOFile, _IOFile, stat_cache
 from snakemake.jobs import Job, Reason
+from snakemake.jobtable import JobTable
 from snakemake.exceptions import RuleException, MissingInputException
 from snakemake.exceptions import MissingRuleException, AmbiguousRuleException
 from snakemake.exceptions import CyclicGraphException, MissingOutputException
@@ -20,6 +27,18 @@ __author__ = "Johannes Köster"
 
 
 class DAG:
+    # bound for the length of dependency chains, protecting against
+    # wildcards that are filled up infinitely
+    MAX_DEPTH = 10000
+    # number of jobs up to which downstream sizes are computed exactly
+    MAX_EXACT_DOWNSTREAM = 20000
+    # number of jobs for which input files are checked ahead of the
+    # resolution of the dependencies
+    MAX_PREFETCH = 10000
+    # seconds to wait before checking missing output files again for the
+    # first time (doubled for each further check)
+    OUTPUT_CHECK_DELAY = 0.005
+
     def __init__(
         self,
         workflow,
@@ -34,7 +53,11 @@ class DAG:
         ignore_ambiguity=False,
         force_incomplete=False,
         ignore_incomplete=False,
-        notemp=False):
+        notemp=False,
+        cores=1):
+
+        # the file system snapshot is taken relative to the working directory
+        stat_cache.clear()
 
         self.dryrun = dryrun
         self.dependencies = defaultdict(partial(defaultdict, set))
@@ -42,12 +65,15 @@ class DAG:
         self._needrun = set()
         self._priority = dict()
         self._downstream_size = dict()
+        self._rank = dict()
         self._reason = defaultdict(Reason)
         self._finished = set()
         self._dynamic = set()
         self._len = 0
         self.workflow = workflow
         self.rules = set(workflow.rules)
+        self._rules = {rule.name: rule for rule in workflow.rules}
+        self.output_index = workflow.output_index
         self.ignore_ambiguity = ignore_ambiguity
         self.targetfiles = targetfiles
         self.targetrules = targetrules
@@ -56,8 +82,39 @@ class DAG:
         self.targetjobs = set()
         self.prioritytargetjobs = set()
         self._ready_jobs = set()
+        # the ready jobs together with the criteria for their selection,
+        # such that the scheduler does not have to collect them again for
+        # each selection
+        self.ready_table = JobTable(workflow.global_resources or ())
+        # number of unfinished dependencies that need to run, per job
+        self._n_until_ready = dict()
+        # number of unfinished consumers that need to run, per temp file,
+        # and the temp files counted for each consumer
+        self._temp_consumers = Counter()
+        self._temp_input = dict()
+        # jobs that were added or lost depending jobs since the last
+        # postprocessing
+        self._changed = set()
         self.notemp = notemp
         self._jobid = dict()
+        self._interned_jobs = defaultdict(dict)
+        self._graph = None
+        # all jobs and the jobs that need to run, in reverse topological order
+        self._jobs = None
+        self._needrun_jobs = None
+        # files whose absence determined the result of the DAG construction
+        self._absent_files = set()
+        # state of the resolved graph, until it is stored in the cache
+        self._cache_state = None
+        # number of threads checking the existence of files during init
+        self.cores = cores
+        self._exists = None
+        self._exists_pool = None
+        self._potential_dependencies = dict()
+        # expected runtime in seconds and resource usage per rule name, e.g.
+        # from the history of previous runs
+        self.runtimes = dict()
+        self.usage = dict()
 
         self.forcerules = set()
         self.forcefiles = set()
@@ -72,23 +129,213 @@ class DAG:
         self.force_incomplete = force_incomplete
         self.ignore_incomplete = ignore_incomplete
 
-    def init(self):
-        """ Initialise the DAG. """
-        for job in map(self.rule2job, self.targetrules):
-            job = self.update([job])
-            self.targetjobs.add(job)
+    def init(self, cache=False):
+        """
+        Initialise the DAG. If cache is True, the jobs and their dependencies
+        are loaded from the .snakemake directory if the cached graph is
+        still valid, and stored there with save_cache otherwise.
+        """
+        if self.cores > 1:
+            # Checking the existence of files is I/O bound and does not hold
+            # the GIL. Hence, a pool of threads checks the files ahead of the
+            # jobs being resolved, while the resolution itself stays
+            # sequential, such that errors remain deterministic.
+            self._exists = dict()
+            self._exists_pool = ThreadPoolExecutor(max_workers=self.cores)
+        try:
+            if not (cache and self.load_cache()):
+                self._prefetch_dependencies()
+                targetrules = sorted(self.targetrules, key=attrgetter("name"))
+                for job in map(self.rule2job, targetrules):
+                    job = self.update([job])
+                    self.targetjobs.add(job)
+                    self._invalidate()
+
+                exceptions = defaultdict(list)
+                for file in sorted(self.targetfiles):
+                    try:
+                        job = self.update(self.file2jobs(file), file=file)
+                        self.targetjobs.add(job)
+                        self._invalidate()
+                    except MissingRuleException as ex:
+                        exceptions[file].append(ex)
+
+                if exceptions:
+                    raise RuleException(include=chain(*exceptions.values()))
+                if cache:
+                    self._cache_state = self.cache_state()
+        finally:
+            if self._exists_pool is not None:
+                # the existence of files is only stable during the init
+                self._exists_pool.shutdown()
+                self._exists_pool = None
+                self._exists = None
+            self._potential_dependencies.clear()
+        self.update_needrun()
+
+    def _prefetch(self, files):
+        """ Check the existence of the given files in the background. """
+        if self._exists is not None:
+            for f in files:
+                if f not in self._exists:
+                    self._exists[f] = self._exists_pool.submit(
+                        stat_cache.exists, f)
 
-        exceptions = defaultdict(list)
-        for file in self.targetfiles:
+    def _prefetch_dependencies(self):
+        """
+        Traverse the potential dependencies of the targets in breadth-first
+        order and check the existence of all input files that no rule can
+        produce in the background. The potential dependencies are kept
+        for the resolution of the jobs.
+        """
+        if self._exists is None:
+            return
+        jobs = list(map(self.rule2job, self.targetrules))
+        for file in sorted(self.targetfiles):
             try:
-                job = self.update(self.file2jobs(file), file=file)
-                self.targetjobs.add(job)
-            except MissingRuleException as ex:
-                exceptions[file].append(ex)
+                jobs.extend(self.file2jobs(file))
+            except MissingRuleException:
+                pass
+        queue = deque((job, 1) for job in jobs)
+        seen = set(jobs)
+        # the traversal is bounded since wildcards can be filled up
+        # infinitely, deeper jobs are reported when the dependencies are
+        # resolved (see _update)
+        while queue and len(seen) < self.MAX_PREFETCH:
+            job, depth = queue.popleft()
+            potential_dependencies = self.collect_potential_dependencies(job)
+            self._potential_dependencies[job] = potential_dependencies
+            self._prefetch(
+                f for f in job.input if f not in potential_dependencies)
+            if depth >= self.MAX_DEPTH:
+                continue
+            for jobs in potential_dependencies.values():
+                for job_ in jobs:
+                    if job_ not in seen:
+                        seen.add(job_)
+                        queue.append((job_, depth + 1))
+
+    def _missing(self, files):
+        """ Return the given files that do not exist, in the given order. """
+        files = list(OrderedDict.fromkeys(files))
+        if self._exists is None:
+            return [f for f in files if not stat_cache.exists(f)]
+        self._prefetch(files)
+        return [f for f in files if not self._exists[f].result()]
+
+    def cache_key(self):
+        """
+        Return a key for the cached job graph. It covers everything the graph
+        depends on apart from the input files of the jobs and the
+        existence of files, which are validated when loading the cache.
+        """
+        key = hashlib.sha1()
+
+        def update(*items):
+            for item in items:
+                key.update(item if isinstance(item, bytes) else
+                    str(item).encode())
+                key.update(b"\0")
+
+        for snakefile in sorted(
+            set(self.workflow.linemaps) | {self.workflow.snakefile}):
+            update(snakefile)
+            if os.path.exists(snakefile):
+                with open(snakefile, "rb") as f:
+                    update(f.read())
+        for rule in self.workflow.rules:
+            update(rule.name, self.workflow.persistence.code(rule))
+            for f in chain(rule.input, rule.output):
+                update(marshal.dumps(f.__code__) if callable(f) else f)
+        for clause in self.workflow._ruleorder:
+            update(*clause)
+        update(*sorted(self.targetfiles))
+        update(*sorted(rule.name for rule in self.targetrules))
+        update(self.ignore_ambiguity)
+        return key.hexdigest()
+
+    @staticmethod
+    def _input_digest(job):
+        return hashlib.sha1("\0".join(job.input).encode()).hexdigest()
+
+    def save_cache(self):
+        """
+        Store the jobs and their dependencies as resolved by init in the
+        cache, if they were not loaded from it. This must only happen while
+        the working directory is locked.
+        """
+        if self._cache_state is not None:
+            self.workflow.persistence.save_dag(
+                self.cache_key(), self._cache_state)
+            self._cache_state = None
+
+    def cache_state(self):
+        """ Return the jobs and their dependencies as stored in the cache. """
+        jobs = list(self.jobs)
+        ids = {job: i for i, job in enumerate(jobs)}
+        edges = list()
+        leaves = set()
+        for job in jobs:
+            produced = set()
+            for job_, files in self.dependencies[job].items():
+                edges.append((ids[job], ids[job_], sorted(map(str, files))))
+                produced.update(files)
+            leaves.update(str(f) for f in job.input if f not in produced)
+        return dict(
+            jobs=[(
+                job.rule.name,
+                None if job.targetfile is None else str(job.targetfile),
+                self.dynamic(job),
+                self._input_digest(job)) for job in jobs],
+            edges=edges,
+            targets=[ids[job] for job in self.targetjobs],
+            leaves=sorted(leaves),
+            absent=sorted(map(str, self._absent_files)))
+
+    def load_cache(self):
+        """
+        Load the jobs and their dependencies from the cache. Return False
+        if there is no valid cached graph for the current workflow.
+        The input files of all jobs are expanded again and compared to the
+        cached ones, and all files that were missing when building the graph
+        have to be still missing, while all leaf input files have to exist.
+        """
+        state = self.workflow.persistence.load_dag(self.cache_key())
+        if state is None:
+            return False
+        absent = state["absent"]
+        if (len(self._missing(absent)) < len(absent)
+            or self._missing(state["leaves"])):
+            logger.debug("Cached DAG is outdated.")
+            return False
 
-        if exceptions:
-            raise RuleException(include=chain(*exceptions.values()))
-        self.update_needrun()
+        jobs = list()
+        for rulename, targetfile, dynamic, digest in state["jobs"]:
+            job = self.new_job(self._rules[rulename], targetfile=targetfile)
+            if self._input_digest(job) != digest:
+                logger.debug("Cached DAG is outdated.")
+                self._interned_jobs.clear()
+                return False
+            jobs.append(job)
+
+        for job in jobs:
+            self.dependencies[job]
+        input = dict()
+        for i, j, files in state["edges"]:
+            job, job_ = jobs[i], jobs[j]
+            if job not in input:
+                input[job] = {f: f for f in job.input}
+            # both directions share the same set of files
+            files = set(map(input[job].__getitem__, files))
+            self.dependencies[job][job_] = files
+            self.depending[job_][job] = files
+        self._dynamic.update(
+            job for job, (_, _, dynamic, _) in zip(jobs, state["jobs"])
+            if dynamic)
+        self.targetjobs.update(map(jobs.__getitem__, state["targets"]))
+        self._invalidate()
+        logger.debug("Loaded DAG from cache.")
+        return True
 
     def check_incomplete(self):
         if not self.ignore_incomplete:
@@ -102,30 +349,53 @@ class DAG:
                     raise IncompleteFilesException(incomplete)
 
     def check_dynamic(self):
-        for job in filter(
+        for job in list(filter(
             lambda job: (job.dynamic_output
-                and not self.needrun(job)), self.jobs):
-            self.update_dynamic(job)
+                and not self.needrun(job)), self.jobs)):
+            # skip jobs that have been replaced by a previous update
+            if job in self.dependencies:
+                self.update_dynamic(job)
+
+    @property
+    def graph(self):
+        """
+        Compact representation of the current DAG. It is rebuilt lazily
+        after the DAG has been modified.
+        """
+        if self._graph is None:
+            self._graph = JobGraph(self.dependencies)
+        return self._graph
+
+    def _invalidate(self):
+        """ Drop the compact graph and job collections of a modified DAG. """
+        self._graph = None
+        self._jobs = None
+        self._needrun_jobs = None
 
     @property
     def jobs(self):
-        """ All jobs in the DAG. """
-        for job in self.bfs(self.dependencies, *self.targetjobs):
-            yield job
+        """
+        All jobs in the DAG, in reverse topological order (i.e. each job
+        before the jobs it depends on). The list is materialized once and
+        kept until the DAG is modified.
+        """
+        if self._jobs is None:
+            jobs = list(self.dfs(self.dependencies, *self.targetjobs))
+            jobs.reverse()
+            self._jobs = jobs
+        return self._jobs
 
     @property
     def needrun_jobs(self):
-        """ Jobs that need to be executed. """
-        for job in filter(self.needrun, self.bfs(
-            self.dependencies, *self.targetjobs, stop=self.noneedrun_finished)):
-            yield job
+        """ Jobs that need to be executed, in reverse topological order. """
+        if self._needrun_jobs is None:
+            self._needrun_jobs = list(filter(self.needrun, self.jobs))
+        return filterfalse(self.finished, self._needrun_jobs)
 
     @property
     def finished_jobs(self):
         """ Jobs that have been executed. """
-        for job in filter(self.finished, self.bfs(
-            self.dependencies, *self.targetjobs)):
-            yield job
+        return filter(self.finished, self.jobs)
 
     @property
     def ready_jobs(self):
@@ -136,6 +406,31 @@ class DAG:
         """ Return whether a given job is ready to execute. """
         return job in self._ready_jobs
 
+    def _set_ready(self, job):
+        self._ready_jobs.add(job)
+        self.ready_table.add(
+            job, self._priority[job], self._downstream_size[job],
+            rank=self._rank[job],
+            usage=self._usage(job),
+            dynamic=bool(job.dynamic_input) or self.dynamic(job))
+
+    def _usage(self, job):
+        """
+        Return the expected usage of the global resources by the given job,
+        rounded up and capped at the available resources like the resources
+        of jobs.
+        """
+        resources = self.workflow.global_resources
+        return {
+            name: min(resources[name], math.ceil(value))
+            for name, value in self.usage.get(job.rule.name, {}).items()
+            if name in resources}
+
+    def _unset_ready(self, job):
+        if job in self._ready_jobs:
+            self._ready_jobs.remove(job)
+            self.ready_table.remove(job)
+
     def needrun(self, job):
         """ Return whether a given job needs to be executed. """
         return job in self._needrun
@@ -146,6 +441,28 @@ class DAG:
     def downstream_size(self, job):
         return self._downstream_size[job]
 
+    @property
+    def runtimes(self):
+        return self._runtimes
+
+    @runtimes.setter
+    def runtimes(self, runtimes):
+        self._runtimes = runtimes
+        # rules without a known runtime take the mean of the known ones
+        self._default_runtime = (sum(runtimes.values()) / len(runtimes)
+            if runtimes else 1)
+
+    def runtime(self, job):
+        """ Return the expected runtime of the given job in seconds. """
+        return self._runtimes.get(job.rule.name, self._default_runtime)
+
+    def rank(self, job):
+        """
+        Return the upward rank of the given job, i.e. the expected time
+        until all jobs depending on it are finished, including itself.
+        """
+        return self._rank[job]
+
     def noneedrun_finished(self, job):
         """
         Return whether a given job is finished or was not
@@ -195,19 +512,32 @@ class DAG:
         return False
 
     def check_output(self, job, wait=3):
-        """ Raise exception if output files of job are missing. """
-        for f in job.expanded_output:
-            if not f.exists:
-                logger.warning("Output file {} not present. Waiting {} "
+        """
+        Raise exception if output files of job are missing.
+        All output files are checked together. Missing files are checked
+        again with exponentially increasing delays until they are present or
+        wait seconds have passed. Return the seconds spent waiting.
+        """
+        missing = [f for f in job.expanded_output if not f.exists]
+        waited = 0
+        if missing:
+            logger.warning("Output files {} not present. Waiting up to {} "
                 "seconds to ensure that this is not because of filesystem "
-                "latency.".format(f, wait))
-                while not f.exists and wait > 0:
-                    wait -= 1
-                    time.sleep(1)
-                if not f.exists:
-                    raise MissingOutputException("Output file {} not "
-                        "produced by rule {}.".format(f, job.rule.name),
-                        lineno=job.rule.lineno, snakefile=job.rule.snakefile)
+                "latency.".format(", ".join(missing), wait))
+            delay = self.OUTPUT_CHECK_DELAY
+            while missing and waited < wait:
+                delay = min(delay, wait - waited)
+                time.sleep(delay)
+                waited += delay
+                delay *= 2
+                for f in missing:
+                    stat_cache.refresh(f)
+                missing = [f for f in missing if not f.exists]
+            if missing:
+                raise MissingOutputException("Output files {} not "
+                    "produced by rule {}.".format(
+                        ", ".join(missing), job.rule.name),
+                    lineno=job.rule.lineno, snakefile=job.rule.snakefile)
         input_maxtime = job.input_maxtime
         if input_maxtime is not None:
             output_mintime = job.output_mintime
@@ -217,6 +547,7 @@ class DAG:
                     "files have a more recent modification date than the "
                     "archive, e.g. by using 'touch'.".format(
                         ", ".join(job.expanded_output)), rule=job.rule)
+        return waited
 
     def handle_protected(self, job):
         """ Write-protect output files that are marked with protected(). """
@@ -225,22 +556,45 @@ class DAG:
                 logger.warning("Write-protecting output file {}".format(f))
                 f.protect()
 
+    def update_temp(self, jobs=None):
+        """
+        Count the unfinished consumers that need to run for each temp file.
+        The counts are decremented by handle_temp.
+        If jobs are given, only their counts are updated.
+        """
+        if jobs is None:
+            self._temp_consumers.clear()
+            self._temp_input.clear()
+            jobs = self._needrun
+        else:
+            for job in jobs:
+                self._temp_consumers.subtract(self._temp_input.pop(job, ()))
+        for job in jobs:
+            if not self.needrun(job) or self.finished(job):
+                continue
+            files = [f for job_, files in self.dependencies[job].items()
+                if job_.temp_output for f in job_.temp_output & files]
+            if files:
+                self._temp_consumers.update(files)
+                self._temp_input[job] = files
+
     def handle_temp(self, job):
-        """ Remove temp files if they are no longer needed. """
+        """
+        Remove temp files if they are no longer needed.
+        The consumer counts are modified without synchronization, hence
+        calls must not overlap with each other or with finish and
+        update_temp (executors hold snakemake.executors.finish_lock).
+        """
         if self.notemp:
             return
 
-        needed = lambda job_, f: any(f in files
-            for j, files in self.depending[job_].items()
-            if not self.finished(j) and self.needrun(j) and j != job)
-
         def unneeded_files():
-            for job_, files in self.dependencies[job].items():
-                for f in job_.temp_output & files:
-                    if not needed(job_, f):
-                        yield f
-            for f in filterfalse(partial(needed, job), job.temp_output):
-                if not f in self.targetfiles:
+            for f in self._temp_input.pop(job, ()):
+                self._temp_consumers[f] -= 1
+                if not self._temp_consumers[f]:
+                    yield f
+            for f in job.temp_output:
+                if not self._temp_consumers[f] and not f in self.targetfiles:
                     yield f
 
         for f in unneeded_files():
@@ -256,9 +610,55 @@ class DAG:
         """ Update the DAG by adding given jobs and their dependencies. """
         if visited is None:
             visited = set()
+        return self._run_update(self._update(
+            jobs, file=file, visited=visited,
+            skip_until_dynamic=skip_until_dynamic))
+
+    def update_(self, job, visited=None, skip_until_dynamic=False):
+        """ Update the DAG by adding the given job and its dependencies. """
+        if visited is None:
+            visited = set()
+        return self._run_update(self._update_(
+            job, visited=visited, skip_until_dynamic=skip_until_dynamic))
+
+    def _run_update(self, update):
+        """
+        Run the given update without recursion.
+
+        Updates are generators that yield the updates they depend on.
+        These are run on an explicit stack and their result is sent back into
+        the yielding update once they are finished. Exceptions are thrown
+        into the yielding update, such that it can handle them like exceptions
+        of a function call.
+        """
+        stack = [update]
+        value, error = None, None
+        while stack:
+            update = stack[-1]
+            try:
+                if error is not None:
+                    ex, error = error, None
+                    stack.append(update.throw(ex))
+                else:
+                    stack.append(update.send(value))
+                value = None
+            except StopIteration as ex:
+                stack.pop()
+                value = ex.value
+            except Exception as ex:
+                stack.pop()
+                if not stack:
+                    raise
+                error = ex
+        return value
+
+    def _update(self, jobs, file=None, visited=None, skip_until_dynamic=False):
         producer = None
         exceptions = list()
-        jobs = sorted(jobs, reverse=not self.ignore_ambiguity)
+        compare = self.output_index.compare
+        rank = cmp_to_key(compare)
+        jobs = sorted(jobs, key=lambda job: rank(job.rule),
+            reverse=not self.ignore_ambiguity)
         cycles = list()
 
         for i, job in enumerate(jobs):
@@ -268,14 +668,20 @@ class DAG:
             if job in visited:
                 cycles.append(job)
                 continue
+            if len(visited) >= self.MAX_DEPTH:
+                raise RuleException("Maximum dependency depth exceeded. "
+                    "Maybe you have a cyclic dependency due to infinitely "
+                    "filled wildcards?\nProblematic "
+                    "input file:\n{}".format(file), rule=job.rule)
             try:
-                self.update_(
-                    job, visited=set(visited),
+                yield self._update_(
+                    job, visited=visited,
                     skip_until_dynamic=skip_until_dynamic)
                 # TODO this might fail if a rule discarded here is needed
                 # elsewhere
                 if i > 0:
-                    if job < jobs[i - 1] or self.ignore_ambiguity:
+                    if (compare(job.rule, jobs[i - 1].rule) < 0
+                        or self.ignore_ambiguity):
                         break
                     elif producer is not None:
                         raise AmbiguousRuleException(
@@ -283,14 +689,6 @@ class DAG:
                 producer = job
             except (MissingInputException, CyclicGraphException) as ex:
                 exceptions.append(ex)
-            except RuntimeError as ex:
-                if (isinstance(ex, RuntimeError) and
-                    str(ex).startswith("maximum recursion depth exceeded")):
-                    ex = RuleException("Maximum recursion depth exceeded. "
-                        "Maybe you have a cyclic dependency due to infinitely "
-                        "filled wildcards?\nProblematic "
-                        "input file:\n{}".format(file), rule=job.rule)
-                raise ex
         if producer is None:
             if cycles:
                 job = cycles[0]
@@ -299,35 +697,46 @@ class DAG:
                 raise exceptions[0]
         return producer
 
-    def update_(self, job, visited=None, skip_until_dynamic=False):
-        """ Update the DAG by adding the given job and its dependencies. """
+    def _update_(self, job, visited=None, skip_until_dynamic=False):
         if job in self.dependencies:
             return
-        if visited is None:
-            visited = set()
+        # visited contains the jobs on the current path, i.e. it is shared
+        # with all updates on the stack instead of being copied
         visited.add(job)
-        dependencies = self.dependencies[job]
-        potential_dependencies = self.collect_potential_dependencies(
-            job).items()
-
-        skip_until_dynamic = skip_until_dynamic and not job.dynamic_output
-
-        producer = dict()
-        exceptions = dict()
-        for file, jobs in potential_dependencies:
-            # TODO check for pumping up wildcards...
-            try:
-                producer[file] = self.update(jobs, file=file, visited=visited,
-                    skip_until_dynamic=skip_until_dynamic
-                        or file in job.dynamic_input)
-            except (MissingInputException, CyclicGraphException) as ex:
-                exceptions[file] = ex
+        try:
+            self._invalidate()
+            dependencies = self.dependencies[job]
+            self._changed.add(job)
+            potential_dependencies = self._potential_dependencies.pop(
+                job, None)
+            if potential_dependencies is None:
+                potential_dependencies = self.collect_potential_dependencies(
+                    job)
+            potential_dependencies = potential_dependencies.items()
+
+            skip_until_dynamic = skip_until_dynamic and not job.dynamic_output
+
+            producer = dict()
+            exceptions = dict()
+            for file, jobs in potential_dependencies:
+                try:
+                    producer[file] = yield self._update(
+                        jobs, file=file, visited=visited,
+                        skip_until_dynamic=skip_until_dynamic
+                            or file in job.dynamic_input)
+                except (MissingInputException, CyclicGraphException) as ex:
+                    exceptions[file] = ex
+        finally:
+            visited.remove(job)
 
         for file, job_ in producer.items():
-            dependencies[job_].add(file)
-            self.depending[job_][job].add(file)
+            # both directions share the same set of files
+            files = dependencies[job_]
+            files.add(file)
+            self.depending[job_][job] = files
 
-        missing_input = job.missing_input - set(producer)
+        missing_input = self._missing(
+            f for f in job.input if f not in producer)
         if missing_input:
             include = list()
             noproducer = list()
@@ -336,19 +745,22 @@ class DAG:
                     include.append(exceptions[f])
                 else:
                     noproducer.append(f)
+            self._absent_files.update(noproducer)
             self.delete_job(job, recursive=False)  # delete job from tree
             raise MissingInputException(job.rule, noproducer, include=include)
 
         if skip_until_dynamic:
             self._dynamic.add(job)
 
-    def update_needrun(self):
-        """ Update the information whether a job needs to be executed. """
-        def output_mintime(job):
-            for job_ in self.bfs(self.depending, job):
-                t = job_.output_mintime
-                if t:
-                    return t
+    def update_needrun(self, jobs=None):
+        """
+        Update the information whether a job needs to be executed.
+        If jobs are given (i.e. the jobs that were added or whose edges
+        changed), only those and the jobs depending on them are evaluated,
+        and the changes are propagated from there.
+        Return the jobs that newly need to run.
+        """
+        output_mintime = dict()
 
         def needrun(job):
             reason = self.reason(job)
@@ -373,7 +785,7 @@ class DAG:
                                 | self.targetfiles)
                     reason.missing_output.update(missing_output)
             if not reason:
-                output_mintime_ = output_mintime(job)
+                output_mintime_ = output_mintime[job]
                 if output_mintime_:
                     updated_input = [f for f in job.input
                         if f.exists and f.is_newer(output_mintime_)]
@@ -387,15 +799,63 @@ class DAG:
         dependencies = self.dependencies
         depending = self.depending
 
-        candidates = set(self.jobs)
-
-        queue = list(filter(reason, map(needrun, candidates)))
+        if jobs is None:
+            changed = None
+            order = self.jobs
+            candidates = set(order)
+            graph = self.graph
+            offsets, targets, _ = graph.depending
+
+            def depending_mintime(job):
+                i = graph.ids.get(job)
+                if i is None:
+                    return ()
+                # depending jobs that are not part of the DAG any more
+                # (e.g. discarded producers) are skipped
+                return (output_mintime.get(graph.jobs[j])
+                    for j in targets[offsets[i]:offsets[i + 1]])
+        else:
+            # The compact graph is not used, since rebuilding it would touch
+            # the whole DAG. Jobs that needed to run before have already
+            # propagated this to their neighbors, hence they only propagate
+            # along the edges to changed jobs.
+            changed = set(jobs)
+            order = self._sorted_subgraph(
+                self._reachable(depending, *changed))
+            candidates = set(order)
+
+            def depending_mintime(job):
+                return map(output_mintime.__getitem__, depending[job])
+
+        # Visit the jobs in reverse topological order, i.e. each job after
+        # all jobs depending on it. Thereby, the oldest output of each job
+        # is memoized, falling back to the nearest depending jobs with
+        # present output if the job has none. With this, outputs are statted
+        # only once and the reasons are determined in the same pass.
+        queue = deque()
+        for job in order:
+            t = job.output_mintime
+            if not t:
+                mintimes = list(filter(None, depending_mintime(job)))
+                t = min(mintimes) if mintimes else None
+            output_mintime[job] = t
+            if job in candidates:
+                needrun(job)
+                if reason(job):
+                    queue.append(job)
         visited = set(queue)
+        newly_needrun = set()
         while queue:
-            job = queue.pop(0)
-            _needrun.add(job)
+            job = queue.popleft()
+            propagate_all = changed is None or job in changed
+            if job not in _needrun:
+                _needrun.add(job)
+                newly_needrun.add(job)
+                propagate_all = True
 
             for job_, files in dependencies[job].items():
+                if not (propagate_all or job_ in changed):
+                    continue
                 missing_output = job_.missing_output(requested=files)
                 reason(job_).missing_output.update(missing_output)
                 if missing_output and not job_ in visited:
@@ -403,56 +863,140 @@ class DAG:
                     queue.append(job_)
 
             for job_, files in depending[job].items():
-                if job_ in candidates:
+                if job_ in candidates and (propagate_all or job_ in changed):
                     reason(job_).updated_input_run.update(files)
                     if not job_ in visited:
                         visited.add(job_)
                         queue.append(job_)
 
         self._len = len(_needrun)
+        if newly_needrun:
+            self._needrun_jobs = None
+        return newly_needrun
 
-    def update_priority(self):
-        """ Update job priorities. """
+    def update_downstream(self, jobs=None):
+        """
+        Update job priorities, downstream sizes (i.e. the number of jobs
+        that directly or indirectly depend on a job) and upward ranks (i.e.
+        the longest expected runtime of a path to the end of the workflow,
+        as in HEFT list scheduling) in a single sweep.
+        Jobs are visited in reverse topological order, such that all can be
+        derived from the jobs depending on them.
+        For more than MAX_EXACT_DOWNSTREAM jobs, the downstream size is
+        approximated by summing up over the depending jobs, which counts jobs
+        that are reachable over multiple paths more than once.
+        If jobs are given, only the jobs upstream of them are updated.
+        """
         prioritized = (lambda job: job.rule in self.priorityrules
             or not self.priorityfiles.isdisjoint(job.output))
-        for job in self.needrun_jobs:
-            self._priority[job] = job.rule.priority
-        for job in self.bfs(
-            self.dependencies, *filter(prioritized, self.needrun_jobs),
-            stop=self.noneedrun_finished):
-            self._priority[job] = Job.HIGHEST_PRIORITY
-
-    def update_ready(self):
-        """ Update information whether a job is ready to execute. """
-        for job in filter(self.needrun, self.jobs):
-            if not self.finished(job) and self._ready(job):
-                self._ready_jobs.add(job)
-
-    def update_downstream_size(self):
-        for job in self.needrun_jobs:
-            self._downstream_size[job] = sum(1 for _ in self.bfs(
-                self.depending, job, stop=self.noneedrun_finished)) - 1
-
-    def postprocess(self):
-        self.update_needrun()
-        self.update_priority()
-        self.update_ready()
-        self.update_downstream_size()
+        stop = self.noneedrun_finished
+        if jobs is None:
+            graph = self.graph
+            offsets, targets, _ = graph.depending
+            order = self.needrun_jobs
+
+            def depending_jobs(job):
+                i = graph.ids[job]
+                return map(graph.jobs.__getitem__,
+                    targets[offsets[i]:offsets[i + 1]])
+        else:
+            # the downstream jobs of the affected ones are visited as well,
+            # since they are needed to derive the affected downstream sizes
+            upstream = self._reachable(self.dependencies, *jobs, stop=stop)
+            order = self._sorted_subgraph(
+                self._reachable(self.depending, *upstream, stop=stop))
+            depending_jobs = self.depending.__getitem__
+        exact = len(self) <= self.MAX_EXACT_DOWNSTREAM
+        # bitset (exact) or count (approximate) of downstream jobs by id
+        ids = dict()
+        downstream = dict()
+        rank = dict()
+        highest = set()
+
+        for job in order:
+            i = ids[job] = len(ids)
+            # depending jobs that have not been visited are finished
+            # or do not need to run
+            depending = [ids[job_] for job_ in depending_jobs(job)
+                if job_ in ids]
+            if exact:
+                bits = 0
+                for j in depending:
+                    bits |= downstream[j] | (1 << j)
+                downstream[i] = bits
+                self._downstream_size[job] = bin(bits).count("1")
+            else:
+                size = min(
+                    len(self) - 1, sum(downstream[j] + 1 for j in depending))
+                downstream[i] = size
+                self._downstream_size[job] = size
+            ranks = [rank[j] for j in depending]
+            rank[i] = self._rank[job] = self.runtime(job) + (
+                max(ranks) if ranks else 0)
+
+            if prioritized(job) or not highest.isdisjoint(depending):
+                highest.add(i)
+                self._priority[job] = Job.HIGHEST_PRIORITY
+            else:
+                self._priority[job] = job.rule.priority
+
+    def update_ready(self, jobs=None):
+        """
+        Update information whether a job is ready to execute.
+        If jobs are given, only those are updated.
+        """
+        # Only jobs that need to run are considered. For each, the unfinished
+        # dependencies that need to run are counted once, such that finish
+        # only has to decrement the counters of the depending jobs.
+        n_until_ready = self._n_until_ready
+        if jobs is None:
+            n_until_ready.clear()
+            jobs = self._needrun
+        for job in jobs:
+            if self.needrun(job) and not self.finished(job):
+                n = sum(1 for job_ in self.dependencies[job]
+                    if self.needrun(job_) and not self.finished(job_))
+                n_until_ready[job] = n
+                if not n:
+                    self._set_ready(job)
+                else:
+                    self._unset_ready(job)
 
-    def _ready(self, job):
-        return self._finished.issuperset(
-            filter(self.needrun, self.dependencies[job]))
+    def postprocess(self, jobs=None):
+        """
+        Update the needrun, downstream, ready and temp information.
+        If jobs are given (i.e. the jobs that were added or lost depending
+        jobs), only the subgraph that is reachable from them is updated.
+        """
+        if jobs is None:
+            self.update_needrun()
+            self.update_downstream()
+            self.update_ready()
+            self.update_temp()
+        else:
+            jobs = set(jobs)
+            jobs.update(self.update_needrun(jobs))
+            self.update_downstream(jobs)
+            # the dependency counters and temp inputs of the depending jobs
+            # change with the jobs that need to run
+            jobs.update(chain(*map(self.depending.__getitem__, list(jobs))))
+            self.update_ready(jobs)
+            self.update_temp(jobs)
+        self._changed.clear()
 
     def finish(self, job, update_dynamic=True):
+        if self.needrun(job) and not self.finished(job):
+            # mark depending jobs as ready once their last dependency that
+            # needs to run is finished
+            n_until_ready = self._n_until_ready
+            for job_ in self.depending[job]:
+                if job_ in n_until_ready:
+                    n_until_ready[job_] -= 1
+                    if not n_until_ready[job_]:
+                        self._set_ready(job_)
         self._finished.add(job)
-        try:
-            self._ready_jobs.remove(job)
-        except KeyError:
-            pass
-        # mark depending jobs as ready
-        for job_ in self.depending[job]:
-            if self.needrun(job_) and self._ready(job_):
-                self._ready_jobs.add(job_)
+        self._n_until_ready.pop(job, None)
+        self._unset_ready(job)
 
         if update_dynamic and job.dynamic_output:
             logger.warning("Dynamically updating jobs")
@@ -463,7 +1007,7 @@ class DAG:
                 self._needrun.add(newjob)
                 self._finished.add(newjob)
 
-                self.postprocess()
+                self.postprocess(self._changed)
                 self.handle_protected(newjob)
 
     def update_dynamic(self, job):
@@ -472,16 +1016,15 @@ class DAG:
             # this happens e.g. in dryrun if output is not yet present
             return
 
-        depending = list(
-            filter(lambda job_: not self.finished(job_),
-                self.bfs(self.depending, job)))
+        depending = list(filter(lambda job_: not self.finished(job_),
+            self._reachable(self.depending, job)))
         newrule, non_dynamic_wildcards = job.rule.dynamic_branch(
             dynamic_wildcards, input=False)
         self.replace_rule(job.rule, newrule)
 
         # no targetfile needed for job
-        newjob = Job(
-            newrule, self, format_wildcards=non_dynamic_wildcards)
+        newjob = self.new_job(
+            newrule, format_wildcards=non_dynamic_wildcards)
         self.replace_job(job, newjob)
         for job_ in depending:
             if job_.dynamic_input:
@@ -490,7 +1033,7 @@ class DAG:
                     self.replace_rule(job_.rule, newrule_)
                     if not self.dynamic(job_):
                         logger.debug("Updating job {}.".format(job_))
-                        newjob_ = Job(newrule_, self,
+                        newjob_ = self.new_job(newrule_,
                             targetfile=job_.targetfile)
 
                         unexpected_output = self.reason(
@@ -504,6 +1047,7 @@ class DAG:
         return newjob
 
     def delete_job(self, job, recursive=True):
+        self._invalidate()
         for job_ in self.depending[job]:
             del self.dependencies[job_][job]
         del self.depending[job]
@@ -512,6 +1056,8 @@ class DAG:
             del depending[job]
             if not depending and recursive:
                 self.delete_job(job_)
+            else:
+                self._changed.add(job_)
         del self.dependencies[job]
         if job in self._needrun:
             self._len -= 1
@@ -521,8 +1067,13 @@ class DAG:
             self._finished.remove(job)
         if job in self._dynamic:
             self._dynamic.remove(job)
-        if job in self._ready_jobs:
-            self._ready_jobs.remove(job)
+        self._unset_ready(job)
+        self._n_until_ready.pop(job, None)
+        self._temp_consumers.subtract(self._temp_input.pop(job, ()))
+        self._priority.pop(job, None)
+        self._downstream_size.pop(job, None)
+        self._rank.pop(job, None)
+        self._changed.discard(job)
 
     def replace_job(self, job, newjob):
         depending = list(self.depending[job].items())
@@ -534,8 +1085,10 @@ class DAG:
 
         for job_, files in depending:
             if not job_.dynamic_input:
-                self.dependencies[job_][newjob].update(files)
-                self.depending[newjob][job_].update(files)
+                files_ = self.dependencies[job_][newjob]
+                files_.update(files)
+                self.depending[newjob][job_] = files_
+        self._invalidate()
         if job in self.targetjobs:
             self.targetjobs.remove(job)
             self.targetjobs.add(newjob)
@@ -547,15 +1100,23 @@ class DAG:
         except KeyError:
             pass  # ignore if rule was already removed
         self.rules.add(newrule)
+        self._rules[newrule.name] = newrule
+        # jobs of the replaced rule may not be handed out any more
+        self._interned_jobs.pop(rule.name, None)
         if rule in self.forcerules:
             self.forcerules.add(newrule)
 
     def collect_potential_dependencies(self, job):
         dependencies = defaultdict(list)
         # use a set to circumvent multiple jobs for the same file
-        # if user specified it twice
+        # if user specified it twice, while keeping the order of the input
+        # files such that errors are deterministic
         file2jobs = self.file2jobs
-        for file in set(job.input):
+        seen = set()
+        for file in job.input:
+            if file in seen:
+                continue
+            seen.add(file)
             try:
                 jobs = self.file2jobs(file)
                 dependencies[file].extend(jobs)
@@ -563,63 +1124,149 @@ class DAG:
                 pass
         return dependencies
 
+    def _adjacency(self, direction):
+        graph = self.graph
+        if direction is self.depending:
+            return graph, graph.depending
+        return graph, graph.dependencies
+
+    def _start_ids(self, graph, jobs, visited):
+        """
+        Return the ids of the given start jobs and mark them as visited.
+        Jobs that are not part of the graph (i.e. without any edges) are
+        returned separately.
+        """
+        ids, isolated = list(), list()
+        for job in jobs:
+            i = graph.ids.get(job)
+            if i is None:
+                isolated.append(job)
+            elif not visited[i]:
+                visited[i] = 1
+                ids.append(i)
+        return ids, isolated
+
     def bfs(self, direction, *jobs, stop=lambda job: False):
-        queue = list(jobs)
-        visited = set(queue)
-        while queue:
-            job = queue.pop(0)
-            if stop(job):
-                # stop criterion reached for this node
-                continue
+        for _, job in self.level_bfs(direction, *jobs, stop=stop):
             yield job
-            for job_, _ in direction[job].items():
-                if not job_ in visited:
-                    queue.append(job_)
-                    visited.add(job_)
 
     def level_bfs(self, direction, *jobs, stop=lambda job: False):
-        queue = [(job, 0) for job in jobs]
-        visited = set(jobs)
+        graph, (offsets, targets, _) = self._adjacency(direction)
+        _jobs = graph.jobs
+        visited = bytearray(len(graph))
+        ids, isolated = self._start_ids(graph, jobs, visited)
+        for job in filterfalse(stop, isolated):
+            yield 0, job
+        queue = deque((i, 0) for i in ids)
         while queue:
-            job, level = queue.pop(0)
+            i, level = queue.popleft()
+            job = _jobs[i]
             if stop(job):
                 # stop criterion reached for this node
                 continue
             yield level, job
             level += 1
-            for job_, _ in direction[job].items():
-                if not job_ in visited:
-                    queue.append((job_, level))
-                    visited.add(job_)
+            for j in targets[offsets[i]:offsets[i + 1]]:
+                if not visited[j]:
+                    visited[j] = 1
+                    queue.append((j, level))
 
     def dfs(self, direction, *jobs, stop=lambda job: False, post=True):
+        graph, (offsets, targets, _) = self._adjacency(direction)
+        _jobs = graph.jobs
+        visited = bytearray(len(graph))
+        for job in jobs:
+            i = graph.ids.get(job)
+            if i is None:
+                # job without any edges
+                if not stop(job):
+                    yield job
+                continue
+            # start jobs are marked lazily, since a start job that is
+            # reachable from a previous one has to be visited by that
+            if visited[i]:
+                continue
+            visited[i] = 1
+            if stop(job):
+                continue
+            if not post:
+                yield _jobs[i]
+            # explicit stack of (job id, position of next edge)
+            stack = [(i, offsets[i])]
+            while stack:
+                i, k = stack[-1]
+                if k < offsets[i + 1]:
+                    stack[-1] = (i, k + 1)
+                    j = targets[k]
+                    if visited[j]:
+                        continue
+                    visited[j] = 1
+                    if stop(_jobs[j]):
+                        continue
+                    if not post:
+                        yield _jobs[j]
+                    stack.append((j, offsets[j]))
+                else:
+                    stack.pop()
+                    if post:
+                        yield _jobs[i]
+
+    def _reachable(self, direction, *jobs, stop=lambda job: False):
+        """
+        Return the jobs that are reachable from the given ones in breadth
+        first order. In contrast to bfs, the adjacency dicts are used
+        directly, such that the compact graph is not rebuilt for traversing
+        a small part of a modified DAG.
+        """
         visited = set()
+        queue = deque()
         for job in jobs:
-            for job_ in self._dfs(
-                direction, job, visited, stop=stop, post=post):
-                yield job_
+            if job not in visited:
+                visited.add(job)
+                queue.append(job)
+        reachable = list()
+        while queue:
+            job = queue.popleft()
+            if stop(job):
+                continue
+            reachable.append(job)
+            for job_ in direction.get(job, ()):
+                if job_ not in visited:
+                    visited.add(job_)
+                    queue.append(job_)
+        return reachable
 
-    def _dfs(self, direction, job, visited, stop, post):
-        if stop(job):
-            return
-        if not post:
-            yield job
-        for job_ in direction[job]:
-            if not job_ in visited:
-                visited.add(job_)
-                for j in self._dfs(direction, job_, visited, stop, post):
-                    yield j
-        if post:
-            yield job
+    def _sorted_subgraph(self, jobs):
+        """
+        Return the given jobs in reverse topological order, i.e. each job
+        after all of the given jobs depending on it.
+        """
+        jobs = list(OrderedDict.fromkeys(jobs))
+        n_depending = {job: 0 for job in jobs}
+        for job in jobs:
+            for job_ in self.dependencies.get(job, ()):
+                if job_ in n_depending:
+                    n_depending[job_] += 1
+        queue = deque(job for job in jobs if not n_depending[job])
+        order = list()
+        while queue:
+            job = queue.popleft()
+            order.append(job)
+            for job_ in self.dependencies.get(job, ()):
+                if job_ in n_depending:
+                    n_depending[job_] -= 1
+                    if not n_depending[job_]:
+                        queue.append(job_)
+        return order
 
     def is_isomorph(self, job1, job2):
         if job1.rule != job2.rule:
             return False
         rule = lambda job: job.rule.name
-        queue1, queue2 = [job1], [job2]
+        queue1, queue2 = deque([job1]), deque([job2])
         visited1, visited2 = set(queue1), set(queue2)
         while queue1 and queue2:
-            job1, job2 = queue1.pop(0), queue2.pop(0)
+            job1, job2 = queue1.popleft(), queue2.popleft()
             deps1 = sorted(self.dependencies[job1], key=rule)
             deps2 = sorted(self.dependencies[job2], key=rule)
             for job1_, job2_ in zip(deps1, deps2):
@@ -659,11 +1306,35 @@ class DAG:
                 new_wildcards.discard(wildcard)
         return new_wildcards
 
+    def new_job(self, rule, targetfile=None, format_wildcards=None):
+        """
+        Return the job of the given rule for the given targetfile.
+        Jobs are interned: if a job with the same rule and wildcards
+        was created before, it is returned without expanding the rule again.
+        """
+        wildcards_dict = rule.get_wildcards(targetfile)
+        key = Job.canonical_key(rule, wildcards_dict)
+        jobs = self._interned_jobs[rule.name]
+        job = jobs.get(key)
+        if job is None:
+            job = Job(
+                rule, self, targetfile=targetfile,
+                format_wildcards=format_wildcards,
+                wildcards_dict=wildcards_dict)
+            jobs[key] = job
+        return job
+
     def rule2job(self, targetrule):
-        return Job(targetrule, self)
+        return self.new_job(targetrule)
 
     def file2jobs(self, targetfile):
-        jobs = [Job(rule, self, targetfile=targetfile) for rule in self.rules if rule.is_producer(targetfile)]
+        # the index yields only the rules that can possibly produce the file
+        # (branches of dynamic rules have the same constant output prefixes
+        # and suffixes, hence they are found via the original rule name)
+        rules = map(self._rules.__getitem__,
+            self.output_index.match(targetfile))
+        jobs = [self.new_job(rule, targetfile=targetfile)
+            for rule in rules if rule.is_producer(targetfile)]
         if not jobs:
             raise MissingRuleException(targetfile)
         return jobs
@@ -722,7 +1393,11 @@ class DAG:
         node2rule = lambda job: job.rule
         node2label = lambda job: "\\n".join(chain([job.rule.name], map(format_wildcard, self.new_wildcards(job))))
 
-        dag = {job: self.dependencies[job] for job in self.jobs}
+        graph, (offsets, targets, _) = self._adjacency(self.dependencies)
+        dag = dict()
+        for job in self.jobs:
+            i = graph.ids[job]
+            dag[job] = [graph.jobs[j] for j in targets[offsets[i]:offsets[i + 1]]]
 
         return self._dot(dag, node2rule=node2rule, node2style=node2style, node2label=node2label)
 
@@ -804,3 +1479,61 @@ class DAG:
 
     def __len__(self):
         return self._len
+
+
+class JobGraph:
+    """
+    Compact, integer-indexed snapshot of the dependencies between jobs.
+
+    Jobs are numbered consecutively. For both directions, the neighbors
+    of job i are stored in CSR format, i.e. they are given by
+    targets[offsets[i]:offsets[i + 1]], and the same slice of files
+    contains the sets of files that the edges are labeled with.
+    The file sets are shared with the DAG instead of being copied.
+    """
+
+    def __init__(self, dependencies):
+        self.jobs = list()
+        self.ids = dict()
+        for job, deps in dependencies.items():
+            for job_ in chain((job,), deps):
+                if job_ not in self.ids:
+                    self.ids[job_] = len(self.jobs)
+                    self.jobs.append(job_)
+
+        n = len(self.jobs)
+        offsets = array("l", [0]) * (n + 1)
+        targets = array("l")
+        files = list()
+        empty = dict()
+        for i, job in enumerate(self.jobs):
+            for job_, files_ in dependencies.get(job, empty).items():
+                targets.append(self.ids[job_])
+                files.append(files_)
+            offsets[i + 1] = len(targets)
+        self.dependencies = (offsets, targets, files)
+
+        # the depending edges are the reversed dependencies,
+        # sorted into place by counting
+        rev_offsets = array("l", [0]) * (n + 1)
+        for j in targets:
+            rev_offsets[j + 1] += 1
+        for i in range(n):
+            rev_offsets[i + 1] += rev_offsets[i]
+        rev_targets = array("l", [0]) * len(targets)
+        rev_files = [None] * len(targets)
+        pos = rev_offsets[:-1]
+        for i in range(n):
+            for k in range(offsets[i], offsets[i + 1]):
+                j = targets[k]
+                rev_targets[pos[j]] = i
+                rev_files[pos[j]] = files[k]
+                pos[j] += 1
+        self.depending = (rev_offsets, rev_targets, rev_files)
+
+    @property
+    def edge_count(self):
+        return len(self.dependencies[1])
+
+    def __len__(self):
+        return len(self.jobs)
@@ -1,5 +1,6 @@
 
 import os
+import sys
 import time
 import textwrap
 import stat
@@ -10,19 +11,48 @@ import threading
 import concurrent.futures
 import subprocess
 import signal
+import socket
+import pickle
 from functools import partial
 from itertools import chain
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
 
 from snakemake.jobs import Job
-from snakemake.shell import shell
+from snakemake.io import stat_cache
+from snakemake.shell import shell, STDOUT
 from snakemake.logging import logger
 from snakemake.stats import Stats
+from snakemake.workers import WorkerPool
 from snakemake.utils import format, Unformattable
 from snakemake.exceptions import print_exception, get_exception_origin
 from snakemake.exceptions import format_error, RuleException
 from snakemake.exceptions import ClusterJobException, ProtectedOutputException, WorkflowError
 
 
+# Worker processes are forked without exec. If such a fork happens while a
+# subprocess is spawned in another thread, the worker inherits the pipe on
+# which the spawning thread waits for the exec, and the thread blocks until
+# the worker exits. Hence, processes are only forked or spawned under this
+# lock.
+fork_lock = threading.RLock()
+
+# Finished jobs are handled off the scheduler thread, while the DAG (e.g. the
+# consumers of temp files), the stat cache and the persistence are not
+# thread-safe. Hence, finished jobs of all executors are only handled under
+# this lock.
+finish_lock = threading.RLock()
+
+
 class AbstractExecutor:
 
     def __init__(self, workflow, dag,
@@ -45,6 +75,10 @@ class AbstractExecutor:
     def shutdown(self):
         pass
 
+    def flush(self):
+        """ Submit the jobs that have been collected by run, if any. """
+        pass
+
     def _run(self, job):
         self.printjob(job)
 
@@ -101,10 +135,21 @@ class AbstractExecutor:
                     "depending on the output of this rule")
 
     def finish_job(self, job):
-        self.dag.check_output(job, wait=self.output_wait)
+        # the job has modified its output files
+        if job.dynamic_output:
+            stat_cache.clear()
+        else:
+            for f in job.expanded_output:
+                stat_cache.invalidate(f)
+            if job.log:
+                stat_cache.invalidate(job.log)
+        self.check_output(job)
         self.dag.handle_protected(job)
         self.dag.handle_temp(job)
 
+    def check_output(self, job):
+        self.dag.check_output(job, wait=self.output_wait)
+
 
 class DryrunExecutor(AbstractExecutor):
     pass
@@ -119,7 +164,7 @@ class RealExecutor(AbstractExecutor):
             workflow, dag, printreason=printreason,
             quiet=quiet, printshellcmds=printshellcmds,
             output_wait=output_wait)
-        self.stats = Stats()
+        self.stats = Stats(persistence=workflow.persistence)
 
     def _run(self, job, callback=None, error_callback=None):
         super()._run(job)
@@ -134,6 +179,12 @@ class RealExecutor(AbstractExecutor):
                 "directory {}".format(
                     e, self.workflow.persistence.path))
 
+    def check_output(self, job):
+        start = time.time()
+        waited = self.dag.check_output(job, wait=self.output_wait)
+        self.stats.report_output_check(
+            job, time.time() - start - waited, waited)
+
     def finish_job(self, job):
         super().finish_job(job)
         self.stats.report_job_end(job)
@@ -166,47 +217,250 @@ class CPUExecutor(RealExecutor):
 
     def __init__(
         self, workflow, dag, cores, printreason=False, quiet=False,
-        printshellcmds=False, threads=False, output_wait=3):
+        printshellcmds=False, threads=False, output_wait=3,
+        warm_workers=False, max_jobs_per_worker=None):
         super().__init__(
             workflow, dag, printreason=printreason, quiet=quiet,
             printshellcmds=printshellcmds, output_wait=output_wait)
         self.pool = (concurrent.futures.ThreadPoolExecutor(max_workers=cores)
             if threads
             else concurrent.futures.ProcessPoolExecutor(max_workers=cores))
+        # persistent workers with preloaded modules for the run methods
+        self.workers = (
+            WorkerPool(
+                workflow, cores, run_wrapper, fork_lock,
+                max_jobs=max_jobs_per_worker)
+            if warm_workers and not threads else None)
+        # the resource usage of a job can only be attributed to it if it
+        # runs in its own process
+        self.measure_usage = not threads
+        # finished jobs are handled (including the verification of their
+        # output, which might wait) off the thread that completes the futures,
+        # one at a time (see finish_lock)
+        self._finish_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1)
 
     def run(
         self, job, callback=None, submit_callback=None, error_callback=None):
         job.prepare()
         super()._run(job)
 
-        future = self.pool.submit(
-            run_wrapper, job.rule.run_func, job.input.plainstrings(), job.output.plainstrings(), job.params,
-            job.wildcards, job.threads, job.resources, str(job.log), self.workflow.linemaps)
+        if self.workers is not None:
+            future = self.workers.submit(
+                job.rule, job.input.plainstrings(), job.output.plainstrings(), job.params,
+                job.wildcards, job.threads, job.resources, str(job.log))
+        else:
+            # the pool forks its processes with the first submission
+            with fork_lock:
+                future = self.pool.submit(
+                    run_wrapper, job.rule.run_func, job.input.plainstrings(), job.output.plainstrings(), job.params,
+                    job.wildcards, job.threads, job.resources, str(job.log), self.workflow.linemaps)
         future.add_done_callback(partial(
             self._callback, job, callback, error_callback))
 
     def shutdown(self):
         self.pool.shutdown()
+        if self.workers is not None:
+            self.workers.shutdown()
+        self._finish_pool.shutdown()
 
     def _callback(self, job, callback, error_callback, future):
+        self._finish_pool.submit(
+            self._finish, job, callback, error_callback, future)
+
+    def _finish(self, job, callback, error_callback, future):
+        with finish_lock:
+            try:
+                ex = future.exception()
+                if ex:
+                    raise ex
+                usage = future.result()
+                if self.measure_usage and usage is not None:
+                    self.stats.report_job_usage(job, *usage)
+                self.finish_job(job)
+                callback(job)
+            except (Exception, BaseException) as ex:
+                print_exception(ex, self.workflow.linemaps)
+                job.cleanup()
+                self.workflow.persistence.cleanup(job)
+                error_callback(job)
+
+
+class AsyncCPUExecutor(CPUExecutor):
+    """
+    Executor that spawns the commands of shell rules directly as
+    subprocesses on an asyncio event loop, running in a separate thread.
+    Only jobs with a run method are executed in the pool of CPUExecutor.
+    """
+
+    def __init__(
+        self, workflow, dag, cores, printreason=False, quiet=False,
+        printshellcmds=False, output_wait=3, warm_workers=False,
+        max_jobs_per_worker=None):
+        super().__init__(
+            workflow, dag, cores, printreason=printreason, quiet=quiet,
+            printshellcmds=printshellcmds, output_wait=output_wait,
+            warm_workers=warm_workers,
+            max_jobs_per_worker=max_jobs_per_worker)
+        self.watcher = ChildWatcher()
+        asyncio.set_child_watcher(self.watcher)
+        self.loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._run_loop)
+        self._loop_thread.daemon = True
+        self._loop_thread.start()
+        # futures of the running shell jobs
+        self._running = set()
+        self._running_lock = threading.Lock()
+
+    @staticmethod
+    def supported():
+        """ Return whether shell jobs can be spawned on this platform. """
+        return asyncio is not None and os.name == "posix"
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(
+        self, job, callback=None, submit_callback=None, error_callback=None):
+        if job.rule.shellcmd is None:
+            super().run(
+                job, callback=callback, submit_callback=submit_callback,
+                error_callback=error_callback)
+            return
+        job.prepare()
+        RealExecutor._run(self, job)
+
+        future = concurrent.futures.Future()
+        with self._running_lock:
+            self._running.add(future)
+        future.add_done_callback(self._done)
+        future.add_done_callback(partial(
+            self._callback, job, callback, error_callback))
         try:
-            ex = future.exception()
-            if ex:
-                raise ex
-            self.finish_job(job)
-            callback(job)
-        except (Exception, BaseException) as ex:
-            print_exception(ex, self.workflow.linemaps)
-            job.cleanup()
-            self.workflow.persistence.cleanup(job)
-            error_callback(job)
+            cmd = self.shellcmd(job)
+        except Exception as ex:
+            future.set_exception(ex)
+            return
+        self.loop.call_soon_threadsafe(self._spawn, job, cmd, future)
+
+    def _done(self, future):
+        with self._running_lock:
+            self._running.discard(future)
+
+    def shellcmd(self, job):
+        """
+        Return the command of the given job, formatted like the shell
+        function formats it within the run method of the rule.
+        """
+        variables = dict(self.workflow.globals)
+        variables.update(
+            input=job.input.plainstrings(), output=job.output.plainstrings(),
+            params=job.params, wildcards=job.wildcards, threads=job.threads,
+            resources=job.resources, log=str(job.log))
+        return shell._process_prefix + format(job.rule.shellcmd, **variables)
+
+    def _spawn(self, job, cmd, future):
+        # the lock is held by the loop thread until the process is spawned
+        # (it is released in _spawned)
+        fork_lock.acquire()
+        spawned = self.loop.create_task(asyncio.create_subprocess_shell(
+            cmd, stdout=STDOUT, **shell._process_args))
+        spawned.add_done_callback(partial(self._spawned, job, cmd, future))
+
+    def _spawned(self, job, cmd, future, spawned):
+        fork_lock.release()
+        if spawned.exception() is not None:
+            future.set_exception(spawned.exception())
+            return
+        process = spawned.result()
+        exited = self.loop.create_task(process.wait())
+        exited.add_done_callback(
+            partial(self._exited, job, cmd, process.pid, future))
+
+    def _exited(self, job, cmd, pid, future, exited):
+        rusage = self.watcher.usage.pop(pid, None)
+        retcode = exited.result()
+        if retcode:
+            future.set_exception(RuleException(
+                str(subprocess.CalledProcessError(retcode, cmd)),
+                rule=job.rule))
+        elif rusage is None:
+            future.set_result(None)
+        else:
+            future.set_result(usage(
+                rusage.ru_maxrss, rusage.ru_inblock, rusage.ru_oublock))
+
+    def shutdown(self):
+        # wait for the running shell jobs
+        with self._running_lock:
+            running = list(self._running)
+        concurrent.futures.wait(running)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._loop_thread.join()
+        self.loop.close()
+        super().shutdown()
+
+
+class ChildWatcher(getattr(asyncio, "AbstractChildWatcher", object)):
+    """
+    Child watcher for asyncio that waits for each child process in a thread
+    with os.wait4. Hence, the event loop may run in any thread, and the
+    resource usage of each child is known (by pid) once it has exited.
+    """
+
+    def __init__(self):
+        self.usage = dict()
+
+    def add_child_handler(self, pid, callback, *args):
+        thread = threading.Thread(
+            target=self._wait, args=(pid, callback, args))
+        thread.daemon = True
+        thread.start()
+
+    def _wait(self, pid, callback, args):
+        try:
+            _, status, rusage = os.wait4(pid, 0)
+        except ChildProcessError:
+            # the child has already been waited for
+            returncode = 255
+        else:
+            self.usage[pid] = rusage
+            returncode = (-os.WTERMSIG(status) if os.WIFSIGNALED(status)
+                else os.WEXITSTATUS(status))
+        # the callback of the event loop is thread-safe
+        callback(pid, returncode, *args)
+
+    def remove_child_handler(self, pid):
+        return False
+
+    def attach_loop(self, loop):
+        pass
+
+    def is_active(self):
+        return True
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
 
 
 class ClusterExecutor(RealExecutor):
+    # bounds of the interval (in seconds) between scans for finished jobs,
+    # the upper bound applies if jobs notify about their completion
+    MIN_SCAN_INTERVAL = 0.1
+    MAX_SCAN_INTERVAL = 2
+    MAX_NOTIFY_SCAN_INTERVAL = 30
 
     def __init__(
         self, workflow, dag, cores, submitcmd="qsub",
-        printreason=False, quiet=False, printshellcmds=False, output_wait=3):
+        printreason=False, quiet=False, printshellcmds=False, output_wait=3,
+        notify=False, array=None):
         super().__init__(
             workflow, dag, printreason=printreason, quiet=quiet,
             printshellcmds=printshellcmds, output_wait=output_wait)
@@ -227,14 +481,50 @@ class ClusterExecutor(RealExecutor):
             raise WorkflowError(e)
 
         self.submitcmd = submitcmd
-        self.threads = []
         self._tmpdir = None
         self.cores = cores if cores else ""
         self.external_jobid = dict()
+        # the environment variable with the task index of array jobs
+        self.array = array
+        # jobs that are submitted as array jobs with the next flush
+        self._unsubmitted = list()
+
+        # submitted jobs by their jobid, until they are finished
+        self._watching = dict()
+        self._watch_lock = threading.Lock()
+        self._stopping = False
+        self._wakeup = threading.Event()
+        # finished jobs are handled one at a time (see finish_lock)
+        self._finish_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1)
+        self._server = None
+        self.max_scan_interval = self.MAX_SCAN_INTERVAL
+        if notify:
+            # jobs connect to this socket when they are finished
+            self._server = socket.socket()
+            self._server.bind(("", 0))
+            self._server.listen(128)
+            self._server.settimeout(1)
+            self.notify_address = (
+                socket.gethostname(), self._server.getsockname()[1])
+            self.max_scan_interval = self.MAX_NOTIFY_SCAN_INTERVAL
+            self._listener = threading.Thread(target=self._listen)
+            self._listener.daemon = True
+            self._listener.start()
+        self._watcher = threading.Thread(target=self._watch)
+        self._watcher.daemon = True
+        self._watcher.start()
 
     def shutdown(self):
-        for thread in self.threads:
-            thread.join()
+        # wait for the submitted jobs
+        with self._watch_lock:
+            self._stopping = True
+        self._wakeup.set()
+        self._watcher.join()
+        self._finish_pool.shutdown()
+        if self._server is not None:
+            self._listener.join()
+            self._server.close()
         shutil.rmtree(self.tmpdir)
 
     def run(
@@ -247,12 +537,69 @@ class ClusterExecutor(RealExecutor):
         jobscript = self.get_jobscript(job)
         jobfinished = os.path.join(self.tmpdir, "{}.jobfinished".format(jobid))
         jobfailed = os.path.join(self.tmpdir, "{}.jobfailed".format(jobid))
+        notify = ""
+        if self._server is not None:
+            notify = "(echo {} > /dev/tcp/{}/{}) 2> /dev/null".format(
+                jobid, *self.notify_address)
+        payload = self.get_payload(job)
+        with open(payload, "wb") as f:
+            pickle.dump(dict(job.payload(), workdir=workdir), f)
         with open(jobscript, "w") as f:
             print(format(self.jobscript, workflow=self.workflow, cores=self.cores), file=f)
         os.chmod(jobscript, os.stat(jobscript).st_mode | stat.S_IXUSR)
 
-        deps = " ".join(self.external_jobid[f] for f in job.input if f in self.external_jobid)
-        submitcmd = job.format_wildcards(self.submitcmd, dependencies=deps)
+        with self._watch_lock:
+            self._watching[str(jobid)] = (
+                job, callback, error_callback, jobscript)
+        if self.array is not None:
+            self._unsubmitted.append((job, jobscript, submit_callback))
+            return
+
+        submitcmd = job.format_wildcards(
+            self.submitcmd, dependencies=self.dependencies([job]))
+        self._submit([job], jobscript, submitcmd)
+        submit_callback(job)
+
+    def flush(self):
+        """
+        Submit the collected jobs, such that jobs of the same rule that need
+        the same resources become the tasks of one array job. The array
+        jobscript executes the jobscript of the task given by the index in
+        the environment variable self.array.
+        """
+        groups = defaultdict(list)
+        for job, jobscript, submit_callback in self._unsubmitted:
+            key = job.rule.name, tuple(sorted(job.resources.items()))
+            groups[key].append((job, jobscript, submit_callback))
+        self._unsubmitted = list()
+
+        for tasks in groups.values():
+            jobs = [job for job, _, _ in tasks]
+            arrayscript = os.path.join(
+                self.tmpdir, "snakemake-array.{}.sh".format(
+                    self.dag.jobid(jobs[0])))
+            with open(arrayscript, "w") as f:
+                print("#!/bin/bash", file=f)
+                print('case "${}" in'.format(self.array), file=f)
+                for i, (_, jobscript, _) in enumerate(tasks, 1):
+                    print('{}) exec "{}" ;;'.format(i, jobscript), file=f)
+                print("esac", file=f)
+            os.chmod(arrayscript, os.stat(arrayscript).st_mode | stat.S_IXUSR)
+
+            submitcmd = jobs[0].format_wildcards(
+                self.submitcmd, dependencies=self.dependencies(jobs),
+                tasks=len(jobs))
+            self._submit(jobs, arrayscript, submitcmd)
+            for job, _, submit_callback in tasks:
+                submit_callback(job)
+
+    def dependencies(self, jobs):
+        """ Return the external jobids the given jobs depend on. """
+        return " ".join(sorted(set(
+            self.external_jobid[f] for job in jobs
+            for f in job.input if f in self.external_jobid)))
+
+    def _submit(self, jobs, jobscript, submitcmd):
         try:
             ext_jobid = subprocess.check_output(
                 '{submitcmd} "{jobscript}"'.format(
@@ -260,40 +607,87 @@ class ClusterExecutor(RealExecutor):
                     jobscript=jobscript),
                 shell=True).decode().split("\n")
         except subprocess.CalledProcessError as ex:
-            raise WorkflowError("Error executing jobscript (exit code {}):\n{}".format(ex.returncode, ex.output.decode()), rule=job.rule)
+            with self._watch_lock:
+                for job in jobs:
+                    del self._watching[str(self.dag.jobid(job))]
+            raise WorkflowError("Error executing jobscript (exit code {}):\n{}".format(ex.returncode, ex.output.decode()), rule=jobs[0].rule)
         if ext_jobid and ext_jobid[0]:
             ext_jobid = ext_jobid[0]
-            self.external_jobid.update((f, ext_jobid) for f in job.output)
-            logger.debug("Submitted job {} with external jobid {}.".format(jobid, ext_jobid))
-
-        thread = threading.Thread(
-            target=self._wait_for_job,
-            args=(job, callback, error_callback,
-                jobscript, jobfinished, jobfailed))
-        thread.daemon = True
-        thread.start()
-        self.threads.append(thread)
-
-        submit_callback(job)
-
-    def _wait_for_job(
-        self, job, callback, error_callback,
-        jobscript, jobfinished, jobfailed):
+            for job in jobs:
+                self.external_jobid.update((f, ext_jobid) for f in job.output)
+            logger.debug("Submitted job(s) {} with external jobid {}.".format(
+                ", ".join(str(self.dag.jobid(job)) for job in jobs),
+                ext_jobid))
+
+    def _watch(self):
+        """
+        Scan the tmpdir for the markers of finished jobs. The interval
+        between scans is doubled while no job finishes.
+        """
+        interval = self.MIN_SCAN_INTERVAL
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            with self._watch_lock:
+                if self._stopping and not self._watching:
+                    return
+            if self._scan():
+                interval = self.MIN_SCAN_INTERVAL
+            else:
+                interval = min(2 * interval, self.max_scan_interval)
+
+    def _scan(self):
+        """
+        Dispatch the handling of all jobs with a marker in the tmpdir and
+        return whether there were any.
+        """
+        found = False
+        # a single read of the directory, the entries are not stat'ed
+        for name in os.listdir(self.tmpdir):
+            jobid, ext = os.path.splitext(name)
+            if ext not in (".jobfinished", ".jobfailed"):
+                continue
+            with self._watch_lock:
+                watched = self._watching.pop(jobid, None)
+            if watched is None:
+                continue
+            found = True
+            self._finish_pool.submit(
+                self._finish, os.path.join(self.tmpdir, name),
+                ext == ".jobfinished", *watched)
+        return found
+
+    def _listen(self):
+        """ Wake up the watcher whenever a job notifies its completion. """
         while True:
-            if os.path.exists(jobfinished):
-                os.remove(jobfinished)
-                os.remove(jobscript)
+            with self._watch_lock:
+                if self._stopping and not self._watching:
+                    return
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            with conn:
+                logger.debug("Job {} notified its completion.".format(
+                    conn.recv(64).decode().strip()))
+            self._wakeup.set()
+
+    def _finish(
+        self, marker, success, job, callback, error_callback, jobscript):
+        try:
+            os.remove(marker)
+            os.remove(jobscript)
+            os.remove(self.get_payload(job))
+            if not success:
+                raise ClusterJobException(
+                    job, self.dag.jobid(job), jobscript)
+            with finish_lock:
                 self.finish_job(job)
                 callback(job)
-                return
-            if os.path.exists(jobfailed):
-                os.remove(jobfailed)
-                os.remove(jobscript)
-                print_exception(
-                    ClusterJobException(job, self.dag.jobid(job), self.get_jobscript(job)), self.workflow.linemaps)
+        except (Exception, BaseException) as ex:
+            print_exception(ex, self.workflow.linemaps)
+            with finish_lock:
                 error_callback(job)
-                return
-            time.sleep(1)
 
     @property
     def tmpdir(self):
@@ -309,11 +703,15 @@ class ClusterExecutor(RealExecutor):
     def get_jobscript(self, job):
         return os.path.join(self.tmpdir, "snakemake-job.{}.sh".format(self.dag.jobid(job)))
 
+    def get_payload(self, job):
+        return os.path.join(self.tmpdir, "snakemake-job.{}.payload".format(self.dag.jobid(job)))
+
 
 def run_wrapper(run, input, output, params, wildcards, threads, resources, log, linemaps):
     """
     Wrapper around the run method that handles directory creation and
-    output file deletion on error.
+    output file deletion on error. Return the peak memory, and the read and
+    written data in megabytes, if the platform reports them.
 
     Arguments
     run       -- the run method
@@ -326,6 +724,9 @@ def run_wrapper(run, input, output, params, wildcards, threads, resources, log,
 
     if log is None:
         log = Unformattable(errormsg="log used but undefined")
+    before = None if resource is None else resource.getrusage(
+        resource.RUSAGE_SELF)
+    shell.reset_usage()
     try:
         # execute the actual run method.
         run(input, output, params, wildcards, threads, resources, log)
@@ -335,3 +736,29 @@ def run_wrapper(run, input, output, params, wildcards, threads, resources, log,
         raise RuleException(format_error(
             ex, lineno, linemaps=linemaps, snakefile=file,
             show_traceback=True))
+    if before is None:
+        return None
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    maxrss, inblock, oublock = shell.usage()
+    # the peak of this process can only be attributed to the job if it
+    # was reached during the job
+    if after.ru_maxrss > before.ru_maxrss:
+        maxrss = max(maxrss, after.ru_maxrss)
+    return usage(
+        maxrss,
+        inblock + after.ru_inblock - before.ru_inblock,
+        oublock + after.ru_oublock - before.ru_oublock)
+
+
+def usage(maxrss, inblock, oublock):
+    """
+    Return the peak memory, and the read and written data in megabytes for
+    the given peak RSS and blocks as reported by getrusage.
+    """
+    # ru_maxrss is given in bytes on OS X and in kilobytes elsewhere,
+    # blocks have 512 bytes
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    return (
+        maxrss * rss_unit / 2 ** 20,
+        inblock * 512 / 2 ** 20,
+        oublock * 512 / 2 ** 20)
@@ -42,15 +42,15 @@ class _IOFile(str):
 
     @property
     def exists(self):
-        return os.path.exists(self.file)
+        return stat_cache.exists(self.file)
 
     @property
     def protected(self):
-        return self.exists and not os.access(self.file, os.W_OK)
+        return self.exists and not stat_cache.writable(self.file)
 
     @property
     def mtime(self):
-        return os.stat(self.file).st_mtime
+        return stat_cache.stat(self.file).st_mtime
 
     def is_newer(self, time):
         return self.mtime > time
@@ -58,13 +58,8 @@ class _IOFile(str):
     def prepare(self):
         path_until_wildcard = re.split(self.dynamic_fill, self.file)[0]
         dir = os.path.dirname(path_until_wildcard)
-        if len(dir) > 0 and not os.path.exists(dir):
-            try:
-                os.makedirs(dir)
-            except OSError as e:
-                # ignore Errno 17 "File exists" (reason: multiprocessing)
-                if e.errno != 17:
-                    raise e
+        if len(dir) > 0:
+            stat_cache.makedirs(dir)
 
     def protect(self):
         mode = (os.stat(self.file).st_mode & ~stat.S_IWUSR &
@@ -77,6 +72,7 @@ class _IOFile(str):
                     os.chmod(os.path.join(self.file, f), mode)
         else:
             os.chmod(self.file, mode)
+        stat_cache.invalidate(self.file)
 
     def remove(self):
         remove(self.file)
@@ -84,6 +80,7 @@ class _IOFile(str):
     def touch(self):
         try:
             os.utime(self.file, None)
+            stat_cache.invalidate(self.file)
         except OSError as e:
             if e.errno == 2:
                 raise MissingOutputException(
@@ -115,6 +112,22 @@ class _IOFile(str):
     def contains_wildcard(self):
         return _wildcard_regex.search(self.file) is not None
 
+    def constant_prefix(self):
+        """ Return the part of the file pattern before the first wildcard. """
+        first_wildcard = _wildcard_regex.search(self.file)
+        if first_wildcard:
+            return self.file[:first_wildcard.start()]
+        return self.file
+
+    def constant_suffix(self):
+        """ Return the part of the file pattern after the last wildcard. """
+        end = None
+        for match in _wildcard_regex.finditer(self.file):
+            end = match.end()
+        if end is None:
+            return ""
+        return self.file[end:]
+
     def regex(self):
         if not self._regex:
             # compile a regular expression
@@ -145,8 +158,163 @@ def remove(file):
             except OSError:
                 # ignore non empty directories
                 pass
+            # removedirs also removes empty parent directories
+            stat_cache.clear()
         else:
             os.remove(file)
+            stat_cache.invalidate(file)
+
+
+class StatCache:
+    """
+    A snapshot of the file system that is shared by all IOFiles.
+    Directories are listed once (with os.scandir if available) such that
+    the existence of the files within them is known without a system call
+    per file. Stat results are remembered per file. The snapshot has to be
+    invalidated for all files that are modified while snakemake runs.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        """ Forget everything about the file system. """
+        self._dirs = dict()
+        self._stat = dict()
+        self._writable = dict()
+        # files that were modified after their directory has been listed
+        self._stale = set()
+        self._created = set()
+
+    def _listing(self, dir):
+        """ Return the entries of the given directory by name or None. """
+        if _scandir is None:
+            return None
+        entries = self._dirs.get(dir)
+        if entries is None:
+            self.misses += 1
+            try:
+                entries = {entry.name: entry for entry in _scandir(dir)}
+            except OSError:
+                entries = dict()
+            self._dirs[dir] = entries
+        return entries
+
+    def _entry(self, path):
+        """
+        Return the normalized path and, if the existence of the file is
+        known from the listing of its directory, its DirEntry or None.
+        Otherwise, False is returned instead of the entry.
+        """
+        path = os.path.normpath(path)
+        if path in self._stale:
+            return path, False
+        dir, name = os.path.split(path)
+        if name in (".", ".."):
+            return path, False
+        entries = self._listing(dir or ".")
+        if entries is None:
+            return path, False
+        return path, entries.get(name)
+
+    def _lookup(self, path, entry):
+        try:
+            result = self._stat[path]
+            self.hits += 1
+            return result
+        except KeyError:
+            pass
+        if entry is None:
+            # the file is not part of the listing of its directory
+            self.hits += 1
+            return None
+        self.misses += 1
+        try:
+            result = os.stat(path)
+        except OSError:
+            result = None
+        self._stat[path] = result
+        return result
+
+    def stat(self, path):
+        """ Return the stat result of the given path like os.stat. """
+        result = self._lookup(*self._entry(path))
+        if result is None:
+            raise FileNotFoundError(2, "No such file or directory", path)
+        return result
+
+    def exists(self, path):
+        """ Return whether the given path exists like os.path.exists. """
+        path, entry = self._entry(path)
+        if entry and path not in self._stat and not entry.is_symlink():
+            # symlinks have to be followed to ensure that they are valid
+            self.hits += 1
+            return True
+        return self._lookup(path, entry) is not None
+
+    def writable(self, path):
+        """ Return whether the given path is writable like os.access. """
+        path = os.path.normpath(path)
+        try:
+            result = self._writable[path]
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            result = self._writable[path] = os.access(path, os.W_OK)
+        return result
+
+    def invalidate(self, path):
+        """ Forget the given path since it was modified. """
+        path = os.path.normpath(path)
+        self._stat.pop(path, None)
+        self._writable.pop(path, None)
+        self._stale.add(path)
+        # the path might be a directory with modified contents
+        self._dirs.pop(path, None)
+
+    def refresh(self, path):
+        """
+        Forget the given path and list its directory again on the next
+        lookup. Listing a directory bypasses stale attribute caches of
+        network file systems.
+        """
+        path = os.path.normpath(path)
+        self._stat.pop(path, None)
+        self._writable.pop(path, None)
+        self._stale.discard(path)
+        self._dirs.pop(os.path.dirname(path) or ".", None)
+
+    def makedirs(self, dir):
+        """
+        Create the given directory unless it has already been created or
+        seen before.
+        """
+        dir = os.path.normpath(dir)
+        if dir in self._created:
+            self.hits += 1
+            return
+        if not self.exists(dir):
+            try:
+                os.makedirs(dir)
+            except OSError as e:
+                # ignore Errno 17 "File exists" (reason: multiprocessing)
+                if e.errno != 17:
+                    raise e
+            # the directory and its created parents
+            parent = dir
+            while parent not in self._created:
+                self.invalidate(parent)
+                parent, child = os.path.dirname(parent), parent
+                if not parent or parent == child:
+                    break
+        self._created.add(dir)
+
+
+_scandir = getattr(os, "scandir", None)
+
+stat_cache = StatCache()
 
 
 def regex(filepattern):
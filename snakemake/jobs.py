@@ -10,7 +10,7 @@ from itertools import chain
 from functools import partial
 from operator import attrgetter
 
-from snakemake.io import IOFile, Wildcards, Resources, _IOFile
+from snakemake.io import IOFile, Wildcards, Resources, _IOFile, stat_cache
 from snakemake.utils import format, listfiles
 from snakemake.exceptions import RuleException, ProtectedOutputException
 from snakemake.exceptions import UnexpectedOutputException
@@ -25,11 +25,26 @@ class Job:
     def files(jobs, type):
         return chain(*map(attrgetter(type), jobs))
 
-    def __init__(self, rule, dag, targetfile=None, format_wildcards=None):
+    @staticmethod
+    def canonical_key(rule, wildcards_dict):
+        """
+        Return the key that identifies a job of the given rule with the
+        given wildcards. All jobs of a rule with dynamic output are
+        considered equal.
+        """
+        if rule.dynamic_output:
+            return (rule.name,)
+        return (rule.name, tuple(sorted(wildcards_dict.items())))
+
+    def __init__(
+        self, rule, dag, targetfile=None, format_wildcards=None,
+        wildcards_dict=None):
         self.rule = rule
         self.dag = dag
         self.targetfile = targetfile
-        self.wildcards_dict = self.rule.get_wildcards(targetfile)
+        self.wildcards_dict = (self.rule.get_wildcards(targetfile)
+            if wildcards_dict is None
+            else wildcards_dict)
         self.wildcards = Wildcards(fromdict=self.wildcards_dict)
         self._format_wildcards = (self.wildcards
             if format_wildcards is None
@@ -59,10 +74,8 @@ class Job:
         for f in self.input:
             if self.ruleio[f] in self.rule.dynamic_input:
                 self.dynamic_input.add(f)
-        self._hash = self.rule.__hash__()
-        if not self.dynamic_output:
-            for o in self.output:
-                self._hash ^= o.__hash__()
+        self._key = self.canonical_key(self.rule, self.wildcards_dict)
+        self._hash = hash(self._key)
 
     @property
     def b64id(self):
@@ -73,10 +86,12 @@ class Job:
     def inputsize(self):
         """
         Return the size of the input files.
-        Input files need to be present.
+        Input files need to be present. Sizes are taken from the stat cache,
+        such that the output files of finished jobs are not statted again.
         """
         if self._inputsize is None:
-            self._inputsize = sum(map(os.path.getsize, self.input))
+            self._inputsize = sum(
+                stat_cache.stat(f).st_size for f in self.input)
         return self._inputsize
 
     @property
@@ -205,6 +220,7 @@ class Job:
                     omit_value=_IOFile.dynamic_fill),
                 self.rule.dynamic_output)):
                 os.remove(f)
+                stat_cache.invalidate(f)
         for f, f_ in zip(self.output, self.rule.output):
             f.prepare()
         if self.log:
@@ -212,6 +228,12 @@ class Job:
 
     def cleanup(self):
         """ Cleanup output files. """
+        # the failed job might have written its output and log after they
+        # have been cached
+        for f in self.expanded_output:
+            stat_cache.invalidate(f)
+        if self.log:
+            stat_cache.invalidate(self.log)
         for f in self.expanded_output:
             if f.exists:
                 f.remove()
@@ -245,14 +267,30 @@ class Job:
         }
         return json.dumps(properties)
 
+    def payload(self):
+        """
+        Return everything that is needed to execute the job without
+        building the DAG (see snakemake.execute_job).
+        """
+        return {
+            "snakefile": self.rule.workflow.snakefile,
+            "rule": self.rule.name,
+            "input": self.input.plainstrings(),
+            "output": self.output.plainstrings(),
+            "params": self.params,
+            "wildcards": self.wildcards,
+            "threads": self.threads,
+            "resources": self.resources,
+            "log": None if self.log is None else str(self.log)
+        }
+
     def __repr__(self):
         return self.rule.name
 
     def __eq__(self, other):
         if other is None:
             return False
-        return self.rule == other.rule and (self.dynamic_output
-            or self.wildcards_dict == other.wildcards_dict)
+        return self._key == other._key
 
     def __lt__(self, other):
         return self.rule.__lt__(other.rule)
@@ -4,8 +4,7 @@
 # properties = {properties}
 source /data/results/gusev/software/exports
 
-snakemake --snakefile {workflow.snakefile} \
---force -j{cores} \
---directory {workdir} --nocolor --notemp --quiet --nolock {job.output} \
+snakemake --execute-job "{payload}" --nocolor \
 && touch "{jobfinished}" || touch "{jobfailed}"
+{notify}
 exit 0
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__author__ = "Johannes Köster"
+
+# marks an unknown input size
+NAN = float("nan")
+
+
+class JobTable:
+    """
+    Columnar table of the jobs that are ready to execute.
+
+    Each row holds the criteria that are rewarded by the job selection
+    (priority, upward rank, downstream size and input size, in the order
+    of their precedence), followed by the resources the job needs, including its
+    threads as resource _cores. Rows are removed by moving the last row into
+    their place, such that adding and removing jobs takes constant time.
+    If NumPy is available, the columns are stored in arrays and the job
+    selection is vectorized, otherwise it falls back to pure Python.
+    """
+
+    PRIORITY, RANK, DOWNSTREAM_SIZE, INPUTSIZE = range(4)
+    CRITERIA = 4
+
+    def __init__(self, resources, use_numpy=True):
+        self.resources = list(resources)
+        self.numpy = use_numpy and np is not None
+        self.jobs = list()
+        self._row = dict()
+        self._rule_ids = dict()
+        self._width = self.CRITERIA + len(self.resources)
+        if self.numpy:
+            self._values = np.zeros((16, self._width))
+            self._rule = np.zeros(16, dtype=np.int64)
+            # rows that may be selected, and rows of dynamic jobs
+            self._selectable = np.zeros(16, dtype=bool)
+            self._dynamic = np.zeros(16, dtype=bool)
+        else:
+            self._values = list()
+            self._rule = list()
+            self._selectable = list()
+            self._dynamic = list()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __contains__(self, job):
+        return job in self._row
+
+    def add(
+        self, job, priority, downstream_size, rank=0, usage=None,
+        dynamic=False):
+        """
+        Add the given job or update its priority, downstream size and rank
+        if it is already contained. The input size is unknown until it is
+        set. Resources given as usage (e.g. measured in previous runs) are
+        needed in addition to the resources of the job, unless the job
+        declares them itself.
+        """
+        i = self._row.get(job)
+        if i is not None:
+            self._values[i][self.PRIORITY] = priority
+            self._values[i][self.RANK] = rank
+            self._values[i][self.DOWNSTREAM_SIZE] = downstream_size
+            return
+        i = self._row[job] = len(self.jobs)
+        self.jobs.append(job)
+        values = [priority, rank, downstream_size, NAN]
+        resources = dict(job.resources.items())
+        if usage:
+            for name, value in usage.items():
+                resources.setdefault(name, value)
+        values.extend(resources.get(name, 0) for name in self.resources)
+        rule = self._rule_ids.setdefault(job.rule, len(self._rule_ids))
+        if self.numpy:
+            if i == len(self._rule):
+                self._grow()
+            self._values[i] = values
+            self._rule[i] = rule
+            self._selectable[i] = True
+            self._dynamic[i] = dynamic
+        else:
+            self._values.append(values)
+            self._rule.append(rule)
+            self._selectable.append(True)
+            self._dynamic.append(dynamic)
+
+    def _grow(self):
+        n = 2 * len(self._rule)
+        values = np.zeros((n, self._width))
+        values[:len(self._values)] = self._values
+        self._values = values
+        for name in ("_rule", "_selectable", "_dynamic"):
+            column = getattr(self, name)
+            grown = np.zeros(n, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def remove(self, job):
+        """ Remove the given job if it is contained. """
+        i = self._row.pop(job, None)
+        if i is None:
+            return
+        last = len(self.jobs) - 1
+        if i < last:
+            moved = self.jobs[last]
+            self.jobs[i] = moved
+            self._row[moved] = i
+            for column in (
+                self._values, self._rule, self._selectable, self._dynamic):
+                column[i] = column[last]
+        self.jobs.pop()
+        if not self.numpy:
+            for column in (
+                self._values, self._rule, self._selectable, self._dynamic):
+                column.pop()
+
+    def disable(self, job):
+        """ Exclude the given job from being selected. """
+        i = self._row.get(job)
+        if i is not None:
+            self._selectable[i] = False
+
+    def set_inputsize(self, job, inputsize):
+        i = self._row.get(job)
+        if i is not None:
+            self._values[i][self.INPUTSIZE] = inputsize
+
+    def _rows(self, dynamic, jobs=None):
+        """
+        Return the rows that may be selected, restricted to the given jobs
+        if any.
+        """
+        n = len(self.jobs)
+        if self.numpy:
+            selectable = self._selectable[:n]
+            if not dynamic:
+                selectable = selectable & ~self._dynamic[:n]
+            if jobs is not None:
+                given = np.zeros(n, dtype=bool)
+                given[[self._row[job] for job in jobs if job in self._row]] = (
+                    True)
+                selectable = selectable & given
+            return np.flatnonzero(selectable)
+        rows = range(n) if jobs is None else sorted(
+            self._row[job] for job in jobs if job in self._row)
+        return [i for i in rows if self._selectable[i]
+            and (dynamic or not self._dynamic[i])]
+
+    def requirements(self, job, maxcores=None):
+        """
+        Return the resources needed by the given job, in the order of the
+        resources of the table. Threads are capped at maxcores if given.
+        """
+        a = [int(v) for v in self._values[self._row[job]][self.CRITERIA:]]
+        cores = self._cores_column()
+        if maxcores is not None and cores is not None:
+            a[cores] = min(a[cores], maxcores)
+        return a
+
+    def unknown_inputsize(self, dynamic=False):
+        """ Return the selectable jobs whose input size is not known yet. """
+        rows = self._rows(dynamic)
+        if self.numpy:
+            rows = rows[np.isnan(self._values[rows, self.INPUTSIZE])]
+        else:
+            rows = [i for i in rows
+                if math.isnan(self._values[i][self.INPUTSIZE])]
+        return [self.jobs[i] for i in rows]
+
+    def selectable(self, dynamic=False):
+        """ Return the jobs that may be selected. """
+        return [self.jobs[i] for i in self._rows(dynamic)]
+
+    def first(self, dynamic=False):
+        """
+        Return the selectable job with the highest priority and rank, the
+        one with the most threads among equal ones, or None.
+        """
+        rows = self._rows(dynamic)
+        cores = self._cores_column()
+        if self.numpy:
+            if not len(rows):
+                return None
+            for k in (self.PRIORITY, self.RANK) + (
+                () if cores is None else (self.CRITERIA + cores,)):
+                column = self._values[rows, k]
+                rows = rows[column == column.max()]
+            return self.jobs[rows[0]]
+        if not rows:
+            return None
+
+        def key(i):
+            values = self._values[i]
+            return (values[self.PRIORITY], values[self.RANK],
+                0 if cores is None else values[self.CRITERIA + cores], -i)
+        return self.jobs[max(rows, key=key)]
+
+    def select(
+        self, capacities, maxcores=None, inputsize=True, dynamic=False,
+        jobs=None):
+        """
+        Select jobs with the greedy heuristic from
+        "A Greedy Algorithm for the General Multidimensional Knapsack
+        Problem", Akcay, Li, Xu, Annals of Operations Research, 2012.
+
+        The problem is solved over the rules instead of the jobs (much less),
+        taking the jobs of each rule by decreasing priority and rank. All
+        jobs of a rule are assumed to need the same resources. Threads are capped at
+        maxcores if given, unknown input sizes are not rewarded, and input
+        sizes are ignored completely if inputsize is False. Dynamic jobs
+        are only selected if dynamic is True. If jobs are given, only those
+        are considered.
+        Return the selected jobs and the remaining capacities.
+        """
+        if self.numpy:
+            rows, starts, x, b = self._select_numpy(
+                capacities, maxcores, inputsize, self._rows(dynamic, jobs))
+        else:
+            rows, starts, x, b = self._select_python(
+                capacities, maxcores, inputsize, self._rows(dynamic, jobs))
+        # the solution is the list of jobs that was selected from the
+        # selected rules
+        solution = [self.jobs[rows[k]]
+            for start, x_j in zip(starts, x)
+            for k in range(start, start + x_j)]
+        return solution, b
+
+    def _cores_column(self):
+        try:
+            return self.resources.index("_cores")
+        except ValueError:
+            return None
+
+    def _select_numpy(self, capacities, maxcores, inputsize, rows):
+        if not len(rows):
+            return rows, [], [], list(capacities)
+        rules = self._rule[rows]
+        # group the rows by rule, sorted by decreasing priority and rank
+        # (stable, i.e. ties keep the order of the rows)
+        order = np.lexsort((
+            -self._values[rows, self.RANK],
+            -self._values[rows, self.PRIORITY], rules))
+        rows, rules = rows[order], rules[order]
+        starts = np.flatnonzero(
+            np.concatenate(([True], rules[1:] != rules[:-1])))
+        u = np.diff(np.append(starts, len(rows)))  # number of jobs left
+
+        # cumulative rewards over the jobs of each rule
+        criteria = self._values[rows, :self.CRITERIA]
+        if inputsize:
+            criteria[np.isnan(criteria[:, self.INPUTSIZE]), self.INPUTSIZE] = 0
+        else:
+            criteria[:, self.INPUTSIZE] = 0
+        c = np.zeros((len(rows) + 1, self.CRITERIA))
+        np.cumsum(criteria, axis=0, out=c[1:])
+
+        # resource usage of the rules and resource capacities
+        a = self._values[rows[starts], self.CRITERIA:].astype(np.int64)
+        cores = self._cores_column()
+        if maxcores is not None and cores is not None:
+            a[:, cores] = np.minimum(a[:, cores], maxcores)
+        b = np.array(capacities, dtype=np.int64)
+        used = a > 0
+        unbounded = np.iinfo(np.int64).max
+
+        n = len(starts)
+        x = np.zeros(n, dtype=np.int64)  # selected jobs of each rule
+        E = np.ones(n, dtype=bool)  # rules free to select
+        while n:
+            # compute effective capacities
+            y = np.where(used, b // np.maximum(a, 1), unbounded).min(axis=1)
+            y = np.maximum(np.minimum(u, y), 0)
+            y[~E] = 0
+            free = np.flatnonzero(y)
+            if not len(free):
+                break
+
+            # compute rewards on cumulative sums and normalize by y
+            # in order to not prefer rules with small weights
+            begin = starts[free] + x[free]
+            reward = (c[begin + y[free]] - c[begin]) / y[free, None]
+            # argmax with the criteria in the order of their precedence
+            best = np.arange(len(free))
+            for k in range(self.CRITERIA):
+                column = reward[best, k]
+                best = best[column == column.max()]
+            j_sel = free[best[0]]
+
+            # batch increment (taking all possible jobs of the rule) and
+            # update information
+            y_sel = y[j_sel]
+            x[j_sel] += y_sel
+            b -= a[j_sel] * y_sel
+            u[j_sel] -= y_sel
+            E[j_sel] = False
+        return rows, starts, x, b.tolist()
+
+    def _select_python(self, capacities, maxcores, inputsize, rows):
+        _values = self._values
+        rows.sort(key=lambda i: (
+            self._rule[i], -_values[i][self.PRIORITY], -_values[i][self.RANK]))
+        starts = [k for k, i in enumerate(rows)
+            if not k or self._rule[i] != self._rule[rows[k - 1]]]
+        u = [end - start
+            for start, end in zip(starts, starts[1:] + [len(rows)])]
+
+        def criteria(i):
+            values = _values[i][:self.CRITERIA]
+            size = values[self.INPUTSIZE]
+            values[self.INPUTSIZE] = (size
+                if inputsize and not math.isnan(size) else 0)
+            return values
+
+        # cumulative rewards over the jobs of each rule
+        c = [[0] * self.CRITERIA]
+        for i in rows:
+            c.append([c_k + v for c_k, v in zip(c[-1], criteria(i))])
+
+        cores = self._cores_column()
+        a = list()
+        for start in starts:
+            a_j = [int(v) for v in _values[rows[start]][self.CRITERIA:]]
+            if maxcores is not None and cores is not None:
+                a_j[cores] = min(a_j[cores], maxcores)
+            a.append(a_j)
+        b = list(capacities)
+
+        n = len(starts)
+        x = [0] * n
+        E = set(range(n))
+        while E:
+            y = [
+                max(0, min([u[j]] + [
+                    b_i // a_j_i for b_i, a_j_i in zip(b, a[j]) if a_j_i > 0]))
+                if j in E else 0
+                for j in range(n)]
+            free = [j for j in range(n) if y[j]]
+            if not free:
+                break
+
+            def reward(j):
+                begin, y_j = starts[j] + x[j], y[j]
+                return [(c_end - c_begin) / y_j
+                    for c_begin, c_end in zip(c[begin], c[begin + y_j])]
+            j_sel = max(free, key=reward)
+
+            y_sel = y[j_sel]
+            x[j_sel] += y_sel
+            b = [b_i - a_j_i * y_sel for b_i, a_j_i in zip(b, a[j_sel])]
+            u[j_sel] -= y_sel
+            E.remove(j_sel)
+        return rows, starts, x, b
+
+
+def knapsack(weights, values, capacity, use_numpy=True):
+    """
+    Solve the 0-1 knapsack problem by dynamic programming. Items have
+    integer weights and tuples of values that are compared in
+    lexicographic order. Return the indices of the selected items.
+    """
+    if use_numpy and np is not None:
+        return _knapsack_numpy(weights, values, capacity)
+    return _knapsack_python(weights, values, capacity)
+
+
+def _knapsack_numpy(weights, values, capacity):
+    dimi, dimj = len(weights) + 1, capacity + 1
+    dimv = len(values[0]) if values else 0
+    # one table per value dimension
+    K = np.zeros((dimv, dimi, dimj))
+    for i in range(1, dimi):
+        w = weights[i - 1]
+        K[:, i] = K[:, i - 1]
+        if w >= dimj:
+            continue
+        prev = K[:, i - 1, w:]
+        new = K[:, i - 1, :dimj - w] + np.array(values[i - 1])[:, None]
+        # take the item if this is lexicographically better
+        better = np.zeros(dimj - w, dtype=bool)
+        equal = np.ones(dimj - w, dtype=bool)
+        for k in range(dimv):
+            better |= equal & (new[k] > prev[k])
+            equal &= new[k] == prev[k]
+        K[:, i, w:][:, better] = new[:, better]
+
+    solution = list()
+    j = dimj - 1
+    for i in range(dimi - 1, 0, -1):
+        if (K[:, i, j] != K[:, i - 1, j]).any():
+            solution.append(i - 1)
+            j -= weights[i - 1]
+    return solution
+
+
+def _knapsack_python(weights, values, capacity):
+    dimi, dimj = len(weights) + 1, capacity + 1
+    zero = tuple(0 for _ in values[0]) if values else ()
+    K = [[zero] * dimj for i in range(dimi)]
+    for i in range(1, dimi):
+        w, v = weights[i - 1], values[i - 1]
+        for j in range(dimj):
+            if w > j:
+                K[i][j] = K[i - 1][j]
+            else:
+                K[i][j] = max(K[i - 1][j],
+                    tuple(map(sum, zip(v, K[i - 1][j - w]))))
+
+    solution = list()
+    j = dimj - 1
+    for i in range(dimi - 1, 0, -1):
+        if K[i][j] != K[i - 1][j]:
+            solution.append(i - 1)
+            j -= weights[i - 1]
+    return solution
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+__author__ = "Johannes Köster"
+
+
+class OutputIndex:
+    """
+    Index over the output files of all rules of a workflow.
+
+    A trie over the constant prefixes (i.e. the part before the first
+    wildcard) of all output files allows to determine the few rules that
+    could produce a given file without matching the regular expressions of
+    all rules. Each trie node stores the rules with an output file of exactly
+    that prefix, together with the constant suffix that a produced file has
+    to end with. Further, the comparisons defined by the ruleorder are
+    precomputed for all pairs of rules that appear in a common clause.
+    """
+
+    def __init__(self, rules, ruleorder=None):
+        self._trie = dict()
+        self._rank = dict()
+        self._order = dict()
+        for rule in rules:
+            self.add(rule)
+        if ruleorder is not None:
+            self._init_ruleorder(ruleorder)
+
+    def add(self, rule):
+        """ Add the output files of the given rule to the index. """
+        self._order.setdefault(rule.name, len(self._order))
+        for o in rule.output:
+            node = self._trie
+            for c in o.constant_prefix():
+                node = node.setdefault(c, dict())
+            # None is used as key for the entries of a node since it
+            # cannot collide with a character
+            node.setdefault(None, set()).add(
+                (o.constant_suffix(), rule.name))
+
+    def match(self, targetfile):
+        """
+        Return the names of all rules that potentially produce the given
+        file (in the order in which they were added). All other rules are
+        guaranteed to not match.
+        """
+        candidates = set()
+        node = self._trie
+        depth = 0
+        while node is not None:
+            for suffix, rulename in node.get(None, ()):
+                if (len(targetfile) - depth >= len(suffix)
+                    and targetfile.endswith(suffix)):
+                    candidates.add(rulename)
+            if depth == len(targetfile):
+                break
+            node = node.get(targetfile[depth])
+            depth += 1
+        return sorted(candidates, key=self._order.__getitem__)
+
+    def compare(self, rule1, rule2):
+        """
+        Return whether rule2 has a higher priority than rule1 according to
+        the ruleorder (see Ruleorder.compare).
+        """
+        return self._rank.get((rule1.name, rule2.name), 0)
+
+    def _init_ruleorder(self, ruleorder):
+        # later clauses overwrite earlier ones, like in Ruleorder.compare
+        for clause in ruleorder:
+            index = dict()
+            for i, rulename in enumerate(clause):
+                index.setdefault(rulename, i)
+            for rule1name, i in index.items():
+                for rule2name, j in index.items():
+                    self._rank[(rule1name, rule2name)] = (j > i) - (j < i)
@@ -300,6 +300,13 @@ class Localrules(GlobalKeywordState):
             'not be executed by the cluster command.', token)
 
 
+class GlobalPreload(GlobalKeywordState):
+
+    @property
+    def keyword(self):
+        return "global_preload"
+
+
 # Rule keyword states
 
 
@@ -329,6 +336,10 @@ class Version(RuleKeywordState):
     pass
 
 
+class Preload(RuleKeywordState):
+    pass
+
+
 class Log(RuleKeywordState):
     pass
 
@@ -402,6 +413,7 @@ class Rule(GlobalKeywordState):
         version=Version,
         log=Log,
         message=Message,
+        preload=Preload,
         run=Run,
         shell=Shell)
 
@@ -484,7 +496,8 @@ class Python(TokenAutomaton):
         ruleorder=Ruleorder,
         rule=Rule,
         subworkflow=Subworkflow,
-        localrules=Localrules)
+        localrules=Localrules,
+        preload=GlobalPreload)
 
     def __init__(self, snakefile, base_indent=0, dedent=0, root=True):
         super().__init__(snakefile, base_indent=base_indent, dedent=dedent, root=root)
@@ -6,7 +6,9 @@ import os
 import shutil
 import signal
 import marshal
-from base64 import urlsafe_b64encode
+import pickle
+import threading
+from base64 import urlsafe_b64encode, urlsafe_b64decode
 from functools import lru_cache, partial
 from itertools import filterfalse, count
 
@@ -16,6 +18,8 @@ from snakemake.utils import listfiles
 
 
 class Persistence:
+    # number of the latest records per rule that the histories consist of
+    HISTORY_LENGTH = 20
 
     def __init__(self, nolock=False, dag=None):
         self.path = os.path.abspath(".snakemake")
@@ -34,8 +38,14 @@ class Persistence:
         self._rule = os.path.join(self.path, "rule_tracking")
         self._input = os.path.join(self.path, "input_tracking")
         self._params = os.path.join(self.path, "params_tracking")
-
-        for d in (self._incomplete, self._version, self._code, self._rule, self._input, self._params):
+        self._dag_cache = os.path.join(self.path, "dag_cache")
+        self._runtime = os.path.join(self.path, "runtime_history")
+        self._usage = os.path.join(self.path, "resource_history")
+        # number of records in the history files appended to by this run
+        self._history_length = dict()
+        self._history_lock = threading.Lock()
+
+        for d in (self._incomplete, self._version, self._code, self._rule, self._input, self._params, self._dag_cache, self._runtime, self._usage):
             if not os.path.exists(d):
                 os.mkdir(d)
 
@@ -166,6 +176,113 @@ class Persistence:
         else:
             return bool(list(cr(file)))
 
+    def load_dag(self, key):
+        """ Return the cached DAG state for the given key or None. """
+        path = os.path.join(self._dag_cache, key)
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            os.utime(path, None)
+            return state
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def save_dag(self, key, state, keep=10):
+        """
+        Cache the DAG state under the given key. Only the most recently
+        used entries are kept.
+        """
+        path = os.path.join(self._dag_cache, key)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # replacing is atomic, hence concurrent runs never see partial files
+        os.replace(tmp, path)
+        entries = sorted(
+            (os.path.join(self._dag_cache, f)
+            for f in os.listdir(self._dag_cache) if not f.endswith(".tmp")),
+            key=os.path.getmtime, reverse=True)
+        for entry in entries[keep:]:
+            self._delete_record_file(entry)
+
+    def record_runtime(self, rule, runtime):
+        """
+        Append the runtime (in seconds) of a job of the given rule to the
+        runtime history.
+        """
+        self._append_history(self._runtime, rule, (runtime,))
+
+    def runtimes(self):
+        """
+        Return the expected runtime (i.e. the mean of the recorded runtimes)
+        per rule name.
+        """
+        return {
+            rule: sum(runtime for runtime, in history) / len(history)
+            for rule, history in self._histories(self._runtime)}
+
+    def record_usage(self, rule, mem_mb, io_mb):
+        """
+        Append the peak memory (in megabytes) and the I/O bandwidth (in
+        megabytes per second) of a job of the given rule to the resource
+        history.
+        """
+        self._append_history(self._usage, rule, (mem_mb, io_mb))
+
+    def usage(self):
+        """
+        Return the expected resource usage per rule name, i.e. the highest
+        recorded peak memory as resource _mem_mb and the mean I/O bandwidth
+        as resource _io_mb.
+        """
+        return {
+            rule: dict(
+                _mem_mb=max(mem_mb for mem_mb, _ in history),
+                _io_mb=sum(io_mb for _, io_mb in history) / len(history))
+            for rule, history in self._histories(self._usage)}
+
+    def _append_history(self, subject, rule, values):
+        """
+        Append values to the history of a rule. Only the latest records are
+        used, and the file is trimmed to them once it holds twice as many.
+        """
+        path = os.path.join(subject, self.b64id(rule.name))
+        keep = self.HISTORY_LENGTH
+        with self._history_lock:
+            length = self._history_length.get(path)
+            if length is None:
+                length = len(self._read_history(path))
+            if length < 2 * keep:
+                with open(path, "a") as f:
+                    print(*values, file=f)
+                self._history_length[path] = length + 1
+                return
+            history = self._read_history(path)[-(keep - 1):] + [values]
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp, "w") as f:
+                for values in history:
+                    print(*values, file=f)
+            os.replace(tmp, path)
+            self._history_length[path] = keep
+
+    def _histories(self, subject):
+        """ Yield the rule names and their non-empty histories. """
+        for f in os.listdir(subject):
+            if f.endswith(".tmp"):
+                continue
+            history = self._read_history(
+                os.path.join(subject, f))[-self.HISTORY_LENGTH:]
+            if history:
+                yield urlsafe_b64decode(f.encode()).decode(), history
+
+    def _read_history(self, path):
+        try:
+            with open(path) as f:
+                return [tuple(map(float, line.split()))
+                    for line in f if line.strip()]
+        except (IOError, ValueError):
+            return list()
+
     def noop(self, *args):
         pass
 
@@ -196,8 +313,11 @@ class Persistence:
                 f.write(value)
 
     def _delete_record(self, subject, id):
+        self._delete_record_file(os.path.join(subject, self.b64id(id)))
+
+    def _delete_record_file(self, path):
         try:
-            os.remove(os.path.join(subject, self.b64id(id)))
+            os.remove(path)
         except OSError as e:
             if e.errno != 2:  # not missing
                 raise e
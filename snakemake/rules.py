@@ -45,6 +45,7 @@ class Rule:
             self.snakefile = snakefile
             self.run_func = None
             self.shellcmd = None
+            self.preload = list()
         elif len(args) == 1:
             other = args[0]
             self.name = other.name
@@ -67,6 +68,7 @@ class Rule:
             self.snakefile = other.snakefile
             self.run_func = other.run_func
             self.shellcmd = other.shellcmd
+            self.preload = other.preload
 
     def dynamic_branch(self, wildcards, input=True):
         def get_io(rule):
@@ -1,21 +1,26 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
+import logging
 import threading
 import multiprocessing
-import operator
 from functools import partial
-from collections import defaultdict
-from itertools import chain, accumulate
+from concurrent.futures import ThreadPoolExecutor
 
 from snakemake.executors import DryrunExecutor, TouchExecutor
 from snakemake.executors import ClusterExecutor, CPUExecutor
+from snakemake.executors import AsyncCPUExecutor
+from snakemake.jobtable import knapsack
 from snakemake.logging import logger
 
 __author__ = "Johannes Köster"
 
 
 class JobScheduler:
+    # threads computing input sizes in the background
+    INPUTSIZE_THREADS = 4
+
     def __init__(
         self,
         workflow,
@@ -29,8 +34,26 @@ class JobScheduler:
         printreason=False,
         printshellcmds=False,
         keepgoing=False,
-        output_wait=3):
-        """ Create a new instance of KnapsackJobScheduler. """
+        output_wait=3,
+        coalesce_window=0,
+        backfill=False,
+        warm_workers=False,
+        max_jobs_per_worker=None,
+        async_shell=False,
+        cluster_notify=False,
+        cluster_array=None):
+        """
+        Create a new instance of KnapsackJobScheduler.
+        Completions of jobs within the given coalesce_window (in seconds)
+        are handled together by a single selection of jobs. With backfill,
+        jobs that need more resources than free get a reservation (see
+        _backfill). With warm_workers, run methods are executed by persistent
+        workers (see snakemake.workers.WorkerPool). With async_shell, shell
+        jobs are spawned directly (see AsyncCPUExecutor). With cluster_notify,
+        cluster jobs notify about their completion via a socket. With
+        cluster_array (the environment variable with the task index), the
+        cluster jobs selected together are submitted as array jobs.
+        """
         self.cluster = cluster
         self.dag = dag
         self.workflow = workflow
@@ -40,6 +63,13 @@ class JobScheduler:
         self.running = set()
         self.failed = set()
         self.finished_jobs = 0
+        self.coalesce_window = coalesce_window
+        self.backfill = backfill
+        # start times of the running jobs
+        self._started = dict()
+        # seconds spent for selecting jobs and the number of selected jobs
+        self._selection_time = 0
+        self._selected_jobs = 0
 
         self.resources = dict(self.workflow.global_resources)
 
@@ -53,6 +83,14 @@ class JobScheduler:
         self._errors = False
         self._finished = False
         self._job_queue = None
+        # whether input sizes are rewarded, and the threads a job may use
+        # at most
+        self._reward_inputsize = True
+        self._maxcores = None
+        # input sizes are computed in the background, such that the job
+        # selection never waits for the file system
+        self._inputsize_pool = None
+        self._inputsize_pending = set()
         self._submit_callback = self._noop
         self._finish_callback = partial(
             self._proceed,
@@ -64,7 +102,7 @@ class JobScheduler:
                 workflow, dag, printreason=printreason,
                 quiet=quiet, printshellcmds=printshellcmds,
                 output_wait=output_wait)
-            self.rule_reward = self.dryrun_rule_reward
+            self._reward_inputsize = False
         elif touch:
             self._executor = TouchExecutor(
                 workflow, dag, printreason=printreason,
@@ -80,12 +118,11 @@ class JobScheduler:
             self._executor = ClusterExecutor(
                 workflow, dag, None, submitcmd=cluster,
                 printreason=printreason, quiet=quiet,
-                printshellcmds=printshellcmds, output_wait=output_wait)
-            self.rule_weight = partial(
-                self.rule_weight,
-                maxcores=1)
+                printshellcmds=printshellcmds, output_wait=output_wait,
+                notify=cluster_notify, array=cluster_array)
+            self._maxcores = 1
             if immediate_submit:
-                self.rule_reward = self.dryrun_rule_reward
+                self._reward_inputsize = False
                 self._submit_callback = partial(
                     self._proceed,
                     update_dynamic=False,
@@ -93,12 +130,25 @@ class JobScheduler:
                     update_resources=False)
             else:
                 self.run = self.run_cluster_or_local
+        elif async_shell and not use_threads and AsyncCPUExecutor.supported():
+            # shell jobs are spawned directly
+            self._executor = AsyncCPUExecutor(
+                workflow, dag, cores, printreason=printreason,
+                quiet=quiet, printshellcmds=printshellcmds,
+                output_wait=output_wait, warm_workers=warm_workers,
+                max_jobs_per_worker=max_jobs_per_worker)
         else:
             self._executor = CPUExecutor(
                 workflow, dag, cores, printreason=printreason,
                 quiet=quiet, printshellcmds=printshellcmds,
                 threads=use_threads,
-                output_wait=output_wait)
+                output_wait=output_wait, warm_workers=warm_workers,
+                max_jobs_per_worker=max_jobs_per_worker)
+        if self._reward_inputsize:
+            self._inputsize_pool = ThreadPoolExecutor(
+                max_workers=self.INPUTSIZE_THREADS)
+            self._compute_inputsizes(
+                self.dag.ready_table.unknown_inputsize(dynamic=self.dryrun))
         self._open_jobs.set()
 
     @property
@@ -108,45 +158,73 @@ class JobScheduler:
         except AttributeError:
             raise TypeError("Executor does not support stats")
 
-    def candidate(self, job):
-        """ Return whether a job is a candidate to be executed. """
-        return (job not in self.running and job not in self.failed and (self.dryrun or
-            (not job.dynamic_input and not self.dag.dynamic(job))))
-
     @property
     def open_jobs(self):
-        """ Return open jobs. """
-        return filter(self.candidate, list(self.dag.ready_jobs))
+        """
+        Return open jobs, i.e. ready jobs that are neither running nor
+        failed. Dynamic jobs are only executed in dryrun mode.
+        """
+        return self.dag.ready_table.selectable(dynamic=self.dryrun)
+
+    @property
+    def overhead(self):
+        """ Return the seconds spent for selecting a job. """
+        if not self._selected_jobs:
+            return 0
+        return self._selection_time / self._selected_jobs
 
     def schedule(self):
         """ Schedule jobs that are ready, maximizing cpu usage. """
         while True:
             try:
                 self._open_jobs.wait()
+                if self.coalesce_window and self.running:
+                    # let further running jobs finish, such that their
+                    # successors are selected together
+                    time.sleep(self.coalesce_window)
             except:
                 # this will be caused because of SIGTERM or SIGINT
-                self._executor.shutdown()
+                self._shutdown()
                 return False
             self._open_jobs.clear()
             if not self.keepgoing and self._errors:
                 logger.warning("Will exit after finishing "
                     "currently running jobs.")
-                self._executor.shutdown()
+                self._shutdown()
                 return False
-            if not any(self.open_jobs):
-                self._executor.shutdown()
-                return not self._errors
-
-            needrun = list(self.open_jobs)
-            assert needrun
-
-            logger.debug("Ready jobs:\n\t" + "\n\t".join(map(str, needrun)))
 
-            run = self.job_selector(needrun)
-            logger.debug("Selected jobs:\n\t" + "\n\t".join(map(str, run)))
+            start = time.time()
+            # the ready table is modified by finishing jobs
+            with self._lock:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Ready jobs:\n\t" + "\n\t".join(
+                        map(str, self.open_jobs)))
+                run = self.job_selector()
+                # running jobs stay ready until they are finished
+                for job in run:
+                    self.dag.ready_table.disable(job)
+            if not run:
+                # no open jobs, or all resources are used by running jobs
+                if self.running:
+                    # wait for the running jobs
+                    continue
+                self._shutdown()
+                return not self._errors
+            self._selection_time += time.time() - start
+            self._selected_jobs += len(run)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Selected jobs:\n\t" + "\n\t".join(map(str, run)))
             self.running.update(run)
+            started = time.time()
             for job in run:
+                self._started[job] = started
                 self.run(job)
+            self._executor.flush()
+
+    def _shutdown(self):
+        self._executor.shutdown()
+        if self._inputsize_pool is not None:
+            self._inputsize_pool.shutdown(wait=False)
 
     def run(self, job):
         self._executor.run(
@@ -172,157 +250,163 @@ class JobScheduler:
             if update_resources:
                 self.finished_jobs += 1
                 self.running.remove(job)
-                for name, value in job.resources.items():
+                self._started.pop(job, None)
+                table = self.dag.ready_table
+                # the ready table also knows the measured resource usage
+                used = (
+                    zip(table.resources, table.requirements(
+                        job, maxcores=self._maxcores))
+                    if job in table else job.resources.items())
+                for name, value in used:
                     if name in self.resources:
                         self.resources[name] += value
 
             self.dag.finish(job, update_dynamic=update_dynamic)
+            if self._inputsize_pool is not None:
+                # the input of the depending jobs is complete now
+                self._compute_inputsizes(filter(
+                    self.dag.ready, self.dag.depending[job]))
 
             if print_progress:
                 self.progress()
 
-            if any(self.open_jobs) or not self.running:
-                # go on scheduling if open jobs are ready or no job is running
-                self._open_jobs.set()
+            # the scheduler decides whether new jobs can be selected,
+            # completions in the meantime are handled together
+            self._open_jobs.set()
 
     def _error(self, job):
         """ Clear jobs and stop the workflow. """
         with self._lock:
             self._errors = True
             self.running.remove(job)
+            self._started.pop(job, None)
             self.failed.add(job)
             if self.keepgoing:
                 logger.warning("Job failed, going on with independent jobs.")
-            else:
-                self._open_jobs.set()
+            self._open_jobs.set()
 
     def _job_selector(self, jobs):
         """ Solve 0-1 knapsack to maximize cpu utilization. """
-
-        dimi, dimj = len(jobs) + 1, self._cores + 1
-        K = [[(0, 0) for c in range(dimj)] for i in range(dimi)]
-        for i in range(1, dimi):
-            for j in range(1, dimj):
-                job = jobs[i - 1]
-                w = self.job_weight(job)
-                v = job.priority, job.inputsize if not self.dryrun else 0
-                if w > j:
-                    K[i][j] = K[i - 1][j]
-                else:
-                    K[i][j] = max(K[i - 1][j],
-                        tuple(map(operator.add, v, K[i - 1][j - w])))
-
-        solution = set()
-        i = dimi - 1
-        j = dimj - 1
-        while i > 0:
-            if K[i][j] != K[i - 1][j]:
-                job = jobs[i - 1]
-                solution.add(job)
-                j = j - job.threads
-            i -= 1
-        return solution
-
-    def job_selector(self, jobs):
+        jobs = list(jobs)
+        values = [
+            (self.dag.priority(job), self.dag.rank(job),
+            job.inputsize if not self.dryrun else 0)
+            for job in jobs]
+        solution = knapsack(
+            list(map(self.job_weight, jobs)), values, self.resources["_cores"])
+        return set(map(jobs.__getitem__, solution))
+
+    def job_selector(self):
         """
-        Using the greedy heuristic from
+        Select jobs from the open jobs in the ready table of the DAG, using
+        the greedy heuristic from
         "A Greedy Algorithm for the General Multidimensional Knapsack
 Problem", Akcay, Li, Xu, Annals of Operations Research, 2012
         """
-        # solve over the rules instead of jobs (much less)
-        _jobs = defaultdict(list)
-        for job in jobs:
-            _jobs[job.rule].append(job)
-        jobs = _jobs
-        # sort the jobs by priority
-        for _jobs in jobs.values():
-            _jobs.sort(key=self.dag.priority, reverse=True)
-        rules = list(jobs)
-
-        # greedyness (1 means take all possible jobs for a selected rule
-        alpha = 1
-
-        # Step 1: initialization
-        n = len(rules)
-        x = [0] * n  # selected jobs of each rule
-        E = set(range(n))  # rules free to select
-        u = [len(jobs[rule]) for rule in rules]  # number of jobs left
-        b = list(self.resources.values())  # resource capacities
-        a = list(map(self.rule_weight, rules))  # resource usage of rules
-        c = list(map(partial(self.rule_reward, jobs=jobs), rules))  # matrix of cumulative rewards over jobs
-
-        while True:
-            # Step 2: compute effective capacities
-            y = [
-                (
-                    min(
-                        (min(u[j], b_i // a_j_i) if a_j_i > 0 else u[j])
-                        for b_i, a_j_i in zip(b, a[j]) if a_j_i)
-                    if j in E else 0)
-                for j in range(n)]
-            if not any(y):
-                break
-
-            # Step 3: compute rewards on cumulative sums and normalize by y
-            # in order to not prefer rules with small weights
-            reward = [(
-                [((crit[x_j + y_j] - crit[x_j]) / y_j if y_j else 0) for crit in c_j]
-                if j in E else [0] * len(c_j))
-                for j, (c_j, y_j, x_j) in enumerate(zip(c, y, x))]
-            j_sel = max(E, key=reward.__getitem__)  # argmax
-
-            # Step 4: batch increment
-            y_sel = min(u[j_sel], max(1, alpha * y[j_sel]))
-
-            # Step 5: update information
-            x[j_sel] += y_sel
-            b = [b_i - (a_j_i * y_sel) for b_i, a_j_i in zip(b, a[j_sel])]
-            u[j_sel] -= y_sel
-            if not u[j_sel] or alpha == 1:
-                E.remove(j_sel)
-            if not E:
-                break
-
-        # Solution is the list of jobs that was selected from the selected rules
-        solution = list(chain(
-            *[jobs[rules[j]][:x_] for j, x_ in enumerate(x)]))
+        table = self.dag.ready_table
+        if self._inputsize_pool is not None:
+            # unknown input sizes are not rewarded until they are computed
+            self._compute_inputsizes(
+                table.unknown_inputsize(dynamic=self.dryrun))
+        capacities = [self.resources.get(name, 0) for name in table.resources]
+        if self.backfill:
+            solution, b = self._backfill(capacities)
+        else:
+            solution, b = table.select(
+                capacities, maxcores=self._maxcores,
+                inputsize=self._reward_inputsize, dynamic=self.dryrun)
         # update resources
-        for name, b_i in zip(self.resources, b):
+        for name, b_i in zip(table.resources, b):
             self.resources[name] = b_i
         return solution
 
-    def rule_weight(self, rule, maxcores=None):
-        res = rule.resources
-        if maxcores is None:
-            maxcores = self.workflow.global_resources["_cores"]
-
-        def calc_res(item):
-            name, value = item
-            if name == "_cores":
-                return min(maxcores, res["_cores"])
-            return min(res.get(name, 0), value)
-
-        return list(map(calc_res, self.workflow.global_resources.items()))
-
-    def rule_reward(self, rule, jobs=None):
-        jobs = jobs[rule]
-        return (
-            self.priority_reward(jobs),
-            self.downstream_reward(jobs),
-            cumsum(map(operator.attrgetter("inputsize"), jobs)))
-
-    def dryrun_rule_reward(self, rule, jobs=None):
-        jobs = jobs[rule]
-        return (
-            self.priority_reward(jobs),
-            self.downstream_reward(jobs),
-            [0] * (len(jobs) + 1))
+    def _backfill(self, capacities):
+        """
+        Select jobs with EASY backfilling: jobs are started by decreasing
+        priority and rank as long as they fit into the free resources. The
+        first job that does not fit gets a reservation at the time when
+        enough resources are expected to be freed by the running jobs (the
+        shadow time). Other jobs are only started if they are expected to
+        finish before the shadow time, or if they fit into the resources
+        that are left at the shadow time. Runtimes are predicted from the
+        runtime history.
+        """
+        table = self.dag.ready_table
+        select = partial(
+            table.select, maxcores=self._maxcores,
+            inputsize=self._reward_inputsize, dynamic=self.dryrun)
+        requirements = partial(table.requirements, maxcores=self._maxcores)
+        now = time.time()
+        # predicted end and resources of the running and selected jobs
+        ends = [
+            (self._expected_end(job), requirements(job))
+            for job in self.running]
+        solution = list()
+        while True:
+            head = table.first(dynamic=self.dryrun)
+            if head is None:
+                return solution, capacities
+            needed = requirements(head)
+            if any(a_i > b_i for a_i, b_i in zip(needed, capacities)):
+                break
+            solution.append(head)
+            # exclude the job from further selection
+            table.disable(head)
+            ends.append((now + self.dag.runtime(head), needed))
+            capacities = [b_i - a_i for b_i, a_i in zip(capacities, needed)]
+
+        # free resources over time if the running jobs end as predicted
+        free = list(capacities)
+        shadow = None
+        for end, a in sorted(ends, key=lambda end: end[0]):
+            free = [b_i + a_i for b_i, a_i in zip(free, a)]
+            if all(a_i <= b_i for a_i, b_i in zip(needed, free)):
+                shadow = max(now, end)
+                break
+        if shadow is None:
+            # the resources are not freed by running jobs, hence there is
+            # nothing to wait for
+            solution_, capacities = select(capacities)
+            return solution + solution_, capacities
+        extra = [b_i - a_i for b_i, a_i in zip(free, needed)]
+
+        short, other = list(), list()
+        for job in table.selectable(dynamic=self.dryrun):
+            if job is head:
+                continue
+            if now + self.dag.runtime(job) <= shadow:
+                short.append(job)
+            else:
+                other.append(job)
+        # jobs running beyond the shadow time may only use the extra
+        # resources, jobs finishing before may use all free resources
+        limited = [min(b_i, e_i) for b_i, e_i in zip(capacities, extra)]
+        solution_, b = select(limited, jobs=other)
+        solution.extend(solution_)
+        capacities = [
+            c_i - (l_i - b_i) for c_i, l_i, b_i in zip(capacities, limited, b)]
+        solution_, capacities = select(capacities, jobs=short)
+        return solution + solution_, capacities
+
+    def _compute_inputsizes(self, jobs):
+        """ Compute the input sizes of the given jobs in the background. """
+        for job in jobs:
+            if job not in self._inputsize_pending:
+                self._inputsize_pending.add(job)
+                self._inputsize_pool.submit(self._set_inputsize, job)
 
-    def priority_reward(self, jobs):
-        return cumsum(map(self.dag.priority, jobs))
+    def _set_inputsize(self, job):
+        try:
+            inputsize = job.inputsize
+        except OSError:
+            # the input is not present (anymore), hence nothing to reward
+            inputsize = 0
+        with self._lock:
+            self._inputsize_pending.discard(job)
+            self.dag.ready_table.set_inputsize(job, inputsize)
 
-    def downstream_reward(self, jobs):
-        return cumsum(map(self.dag.downstream_size, jobs))
+    def _expected_end(self, job):
+        return self._started.get(job, 0) + self.dag.runtime(job)
 
     def job_weight(self, job):
         """ Job weight that uses threads. """
@@ -337,6 +421,3 @@ Problem", Akcay, Li, Xu, Annals of Operations Research, 2012
         logger.info("{} of {} steps ({:.0%}) done".format(self.finished_jobs,
             len(self.dag), self.finished_jobs / len(self.dag)))
 
-
-def cumsum(iterable, zero=[0]):
-    return list(chain(zero, accumulate(iterable)))
@@ -21,6 +21,11 @@ if not isinstance(sys.stdout, _io.TextIOWrapper):
 class shell:
     _process_args = {}
     _process_prefix = ""
+    # peak RSS (in kilobytes) and blocks read and written by the commands
+    # since the last reset, if the platform reports them
+    _maxrss = 0
+    _inblock = 0
+    _oublock = 0
 
     @classmethod
     def executable(cls, cmd):
@@ -30,6 +35,35 @@ class shell:
     def prefix(cls, prefix):
         cls._process_prefix = format(prefix, stepout=2)
 
+    @classmethod
+    def reset_usage(cls):
+        cls._maxrss = cls._inblock = cls._oublock = 0
+
+    @classmethod
+    def usage(cls):
+        """
+        Return the peak RSS in kilobytes and the number of blocks read and
+        written by the commands since the last reset.
+        """
+        return cls._maxrss, cls._inblock, cls._oublock
+
+    @classmethod
+    def _wait(cls, proc):
+        """
+        Wait for the given process and return its exit code. If available,
+        wait4 is used in order to account the resource usage of the process
+        (including its waited children).
+        """
+        if not hasattr(os, "wait4"):
+            return proc.wait()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = (-os.WTERMSIG(status) if os.WIFSIGNALED(status)
+            else os.WEXITSTATUS(status))
+        cls._maxrss = max(cls._maxrss, rusage.ru_maxrss)
+        cls._inblock += rusage.ru_inblock
+        cls._oublock += rusage.ru_oublock
+        return proc.returncode
+
     def __new__(
         cls, cmd, *args, async=False, iterable=False, read=False, **kwargs):
         cmd = format(cmd, *args, stepout=2, **kwargs)
@@ -46,7 +80,7 @@ class shell:
             ret = proc.stdout.read()
         elif async:
             return proc
-        retcode = proc.wait()
+        retcode = cls._wait(proc)
         if retcode:
             raise sp.CalledProcessError(retcode, cmd)
         return ret
@@ -55,7 +89,7 @@ class shell:
     def iter_stdout(proc, cmd):
         for l in proc.stdout:
             yield l[:-1]
-        retcode = proc.wait()
+        retcode = shell._wait(proc)
         if retcode:
             raise sp.CalledProcessError(retcode, cmd)
 
@@ -3,17 +3,46 @@ import time
 import csv
 from collections import defaultdict
 
+from snakemake.logging import logger
+
 
 class Stats:
-    def __init__(self):
+    def __init__(self, persistence=None):
+        """
+        If persistence is given, the runtimes and resource usage of finished
+        jobs are recorded in its history.
+        """
+        self.persistence = persistence
         self.starttime = dict()
         self.endtime = dict()
+        self.output_check = dict()
+        self.usage = dict()
 
     def report_job_start(self, job):
         self.starttime[job] = time.time()
 
+    def report_job_usage(self, job, mem_mb, read_mb, write_mb):
+        """ Report the peak memory and the read and written megabytes. """
+        self.usage[job] = (mem_mb, read_mb, write_mb)
+
     def report_job_end(self, job):
         self.endtime[job] = time.time()
+        if self.persistence is not None and job in self.starttime:
+            runtime = self.endtime[job] - self.starttime[job]
+            try:
+                self.persistence.record_runtime(job.rule, runtime)
+                if job in self.usage:
+                    mem_mb, read_mb, write_mb = self.usage[job]
+                    self.persistence.record_usage(
+                        job.rule, mem_mb,
+                        (read_mb + write_mb) / max(runtime, 0.001))
+            except IOError as e:
+                logger.warning("Failed to record the runtime of job "
+                    "({}). Please ensure write permissions for the "
+                    "directory {}".format(e, self.persistence.path))
+
+    def report_output_check(self, job, latency, wait):
+        self.output_check[job] = (latency, wait)
 
     @property
     def rule_runtimes(self):
@@ -51,3 +80,11 @@ class Stats:
             writer.writerow("file starttime endtime".split())
             for runtime in self.job_runtimes:
                 writer.writerow(runtime)
+            writer.writerow(list())
+            writer.writerow("file output-check-latency output-wait".split())
+            for job, (latency, wait) in self.output_check.items():
+                writer.writerow((job, latency, wait))
+            writer.writerow(list())
+            writer.writerow("file peak-memory-mb read-mb write-mb".split())
+            for job, usage in self.usage.items():
+                writer.writerow((job,) + usage)
@@ -0,0 +1,188 @@
+
+import threading
+import importlib
+import multiprocessing
+import concurrent.futures
+from collections import deque
+
+from snakemake.exceptions import WorkflowError
+
+__author__ = "Johannes Köster"
+
+
+class Worker:
+    """
+    A persistent process that executes the run methods of jobs. It is forked
+    from the main process, such that it has access to the rules of the
+    workflow without pickling them.
+    """
+
+    def __init__(self, pool):
+        self.jobs = 0
+        self.alive = True
+        # rules whose jobs have been executed and modules that have been
+        # imported by this worker
+        self.rules = set()
+        self.modules = set(pool.workflow.preload_modules)
+        self.conn, conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=pool._work, args=(conn, ))
+        self.process.daemon = True
+        with pool.fork_lock:
+            self.process.start()
+        conn.close()
+
+    def execute(self, rule, modules, args):
+        """ Execute the run method of the given rule in the worker. """
+        self.jobs += 1
+        self.rules.add(rule.name)
+        self.modules.update(modules)
+        try:
+            self.conn.send((rule.name, modules, args))
+            success, result = self.conn.recv()
+        except (EOFError, OSError):
+            self.alive = False
+            raise WorkflowError(
+                "Worker process {} terminated unexpectedly.".format(
+                    self.process.pid))
+        if not success:
+            raise result
+        return result
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    """
+    Pool of warm worker processes for the run methods of jobs. Modules that
+    shall be preloaded (globally or for a rule) are imported only once per
+    worker, and jobs of a rule are preferably executed by a worker that
+    already executed jobs of the same rule. Workers are replaced after
+    executing max_jobs jobs.
+    """
+
+    def __init__(self, workflow, size, run_wrapper, fork_lock, max_jobs=None):
+        self.workflow = workflow
+        self.size = size
+        self.run_wrapper = run_wrapper
+        # lock that has to be held while forking (see snakemake.executors)
+        self.fork_lock = fork_lock
+        self.max_jobs = max_jobs
+        self.workers = list()
+        self._idle = list()
+        self._pending = deque()
+        self._lock = threading.Lock()
+        # threads that wait for the workers
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=size)
+
+    def submit(self, rule, *args):
+        """
+        Submit a job of the given rule with the arguments of the run method.
+        Return a future for the result of the run wrapper.
+        """
+        future = concurrent.futures.Future()
+        modules = list(self.workflow.preload_modules) + list(rule.preload)
+        with self._lock:
+            self._pending.append((rule, modules, args, future))
+            self._dispatch()
+        return future
+
+    def shutdown(self):
+        self._pool.shutdown()
+        with self._lock:
+            for worker in self.workers:
+                worker.stop()
+            self.workers = list()
+            self._idle = list()
+
+    def _dispatch(self):
+        while self._pending and (
+            self._idle or len(self.workers) < self.size):
+            rule, modules, args, future = self._pending.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            worker = self._worker(rule, modules)
+            self._pool.submit(
+                self._execute, worker, rule, modules, args, future)
+
+    def _worker(self, rule, modules):
+        """
+        Return a worker for the given rule, preferring idle workers that
+        executed the rule before or already imported the modules, then new
+        workers.
+        """
+        for affine in (
+            lambda worker: rule.name in worker.rules,
+            lambda worker: worker.modules.issuperset(modules)):
+            for worker in self._idle:
+                if affine(worker):
+                    self._idle.remove(worker)
+                    return worker
+        if len(self.workers) < self.size:
+            worker = Worker(self)
+            self.workers.append(worker)
+            return worker
+        return self._idle.pop()
+
+    def _execute(self, worker, rule, modules, args, future):
+        try:
+            result = worker.execute(rule, modules, args)
+        except BaseException as ex:
+            result, exception = None, ex
+        else:
+            exception = None
+        with self._lock:
+            if worker.alive and (
+                self.max_jobs is None or worker.jobs < self.max_jobs):
+                self._idle.append(worker)
+            else:
+                # recycle the worker
+                self.workers.remove(worker)
+                worker.stop()
+            self._dispatch()
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+
+    def _work(self, conn):
+        """ The main loop of a worker process. """
+        for module in self.workflow.preload_modules:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                # the error is reported with the first job of the worker
+                pass
+        while True:
+            try:
+                task = conn.recv()
+            except EOFError:
+                break
+            if task is None:
+                break
+            rulename, modules, args = task
+            try:
+                for module in modules:
+                    try:
+                        importlib.import_module(module)
+                    except ImportError as ex:
+                        raise WorkflowError(
+                            "Failed to preload module {}:".format(module),
+                            ex)
+                run = self.workflow.get_rule(rulename).run_func
+                result = True, self.run_wrapper(
+                    run, *(args + (self.workflow.linemaps, )))
+            except BaseException as ex:
+                result = False, ex
+            try:
+                conn.send(result)
+            except Exception as ex:
+                # the exception could not be pickled
+                conn.send((False, WorkflowError(str(result[1]))))
+        conn.close()
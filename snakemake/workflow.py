@@ -21,6 +21,8 @@ from snakemake.scheduler import JobScheduler
 from snakemake.parser import parse
 from snakemake.io import protected, temp, temporary, expand, dynamic, glob_wildcards
 from snakemake.persistence import Persistence
+from snakemake.output_index import OutputIndex
+from snakemake.io import stat_cache
 
 
 class Workflow:
@@ -32,7 +34,9 @@ class Workflow:
         self.first_rule = None
         self._workdir = None
         self._ruleorder = Ruleorder()
+        self._output_index = None
         self._localrules = set()
+        self.preload_modules = list()
         self.linemaps = dict()
         self.rule_count = 0
         self.basedir = os.path.dirname(snakefile)
@@ -56,12 +60,19 @@ class Workflow:
     def concrete_files(self):
         return (file for rule in self.rules for file in chain(rule.input, rule.output) if not callable(file) and not file.contains_wildcard())
 
+    @property
+    def output_index(self):
+        if self._output_index is None:
+            self._output_index = OutputIndex(self.rules, self._ruleorder)
+        return self._output_index
+
     def check(self):
         for clause in self._ruleorder:
             for rulename in clause:
                 if not self.is_rule(rulename):
                     raise UnknownRuleException(
                         rulename, prefix = "Error in ruleorder definition.")
+        self._output_index = OutputIndex(self.rules, self._ruleorder)
 
     def add_rule(self, name=None, lineno=None, snakefile=None):
         """
@@ -125,10 +136,18 @@ class Workflow:
         list_input_changes=False, list_params_changes=False,
         summary=False, output_wait=3, nolock=False, unlock=False,
         resources=None, notemp=False, nodeps=False,
-        cleanup_metadata=None):
+        cleanup_metadata=None, dag_cache=False, coalesce_window=0,
+        backfill=False, mem_budget=None, io_budget=None,
+        warm_workers=False, max_jobs_per_worker=None, async_shell=False,
+        cluster_notify=False, cluster_array=None):
 
         self.global_resources = dict() if cluster or resources is None else resources
         self.global_resources["_cores"] = cores
+        # budgets for the resource usage measured in previous runs
+        if mem_budget is not None:
+            self.global_resources["_mem_mb"] = mem_budget
+        if io_budget is not None:
+            self.global_resources["_io_mb"] = io_budget
 
         def rules(items):
             return map(self._rules.__getitem__, filter(self.is_rule, items))
@@ -166,7 +185,7 @@ class Workflow:
             forcerules=forcerules, priorityfiles=priorityfiles,
             priorityrules=priorityrules, ignore_ambiguity=ignore_ambiguity,
             force_incomplete=force_incomplete,
-            ignore_incomplete=ignore_incomplete, notemp=notemp)
+            ignore_incomplete=ignore_incomplete, notemp=notemp, cores=cores)
 
         self.persistence = Persistence(nolock=nolock, dag=dag)
 
@@ -175,7 +194,7 @@ class Workflow:
                 self.persistence.cleanup_metadata(f)
             return True
 
-        dag.init()
+        dag.init(cache=dag_cache)
         dag.check_dynamic()
 
         if unlock:
@@ -200,7 +219,10 @@ class Workflow:
                 "the --unlock argument.".format(os.getcwd()))
             return False
 
+        dag.save_cache()
         dag.check_incomplete()
+        dag.runtimes = self.persistence.runtimes()
+        dag.usage = self.persistence.usage()
         dag.postprocess()
 
         if nodeps:
@@ -253,7 +275,10 @@ class Workflow:
             immediate_submit=immediate_submit,
             quiet=quiet, keepgoing=keepgoing,
             printreason=printreason, printshellcmds=printshellcmds,
-            output_wait=output_wait)
+            output_wait=output_wait, coalesce_window=coalesce_window,
+            backfill=backfill, warm_workers=warm_workers,
+            max_jobs_per_worker=max_jobs_per_worker, async_shell=async_shell,
+            cluster_notify=cluster_notify, cluster_array=cluster_array)
 
         if not dryrun and not quiet and len(dag):
             if cluster:
@@ -263,6 +288,10 @@ class Workflow:
             logger.warning("\n".join(dag.stats()))
 
         success = scheduler.schedule()
+        logger.debug("Stat cache: {} hits, {} misses.".format(
+            stat_cache.hits, stat_cache.misses))
+        logger.debug("Scheduler overhead: {:.3f} ms per job.".format(
+            scheduler.overhead * 1000))
 
         if success:
             if dryrun:
@@ -287,6 +316,8 @@ class Workflow:
         first_rule = self.first_rule
         if workdir:
             os.chdir(workdir)
+            # the given workdir overrides the workdir directive
+            self._workdir = workdir
         code, linemap = parse(snakefile)
 
         if print_compilation:
@@ -315,6 +346,9 @@ class Workflow:
     def localrules(self, *rulenames):
         self._localrules.update(rulenames)
 
+    def global_preload(self, *modules):
+        self.preload_modules.extend(modules)
+
     def rule(self, name=None, lineno=None, snakefile=None):
         name = self.add_rule(name, lineno, snakefile)
         rule = self.get_rule(name)
@@ -350,6 +384,12 @@ class Workflow:
                 rule.log = ruleinfo.log
             if ruleinfo.message:
                 rule.message = ruleinfo.message
+            if ruleinfo.preload:
+                if not all(isinstance(module, str)
+                    for module in ruleinfo.preload):
+                    raise RuleException("Preload values have to be module "
+                        "names.", rule=rule)
+                rule.preload = list(ruleinfo.preload)
             rule.docstring = ruleinfo.docstring
             rule.run_func = ruleinfo.func
             rule.shellcmd = ruleinfo.shellcmd
@@ -418,6 +458,12 @@ class Workflow:
             return ruleinfo
         return decorate
 
+    def preload(self, *modules):
+        def decorate(ruleinfo):
+            ruleinfo.preload = modules
+            return ruleinfo
+        return decorate
+
     def shellcmd(self, cmd):
         def decorate(ruleinfo):
             ruleinfo.shellcmd = cmd
@@ -446,6 +492,7 @@ class RuleInfo:
         self.priority = None
         self.version = None
         self.log = None
+        self.preload = None
         self.docstring = None
 
 class Subworkflow:
@@ -0,0 +1,327 @@
+"""
+Benchmarks for the DAG construction and traversal on synthetic workflows.
+Run with: python tests/benchmarks.py [NAME ...]
+"""
+
+import sys
+import os
+import time
+import threading
+import tracemalloc
+from os.path import join
+from tempfile import mkdtemp
+from subprocess import call
+
+sys.path.insert(0, join(os.path.dirname(__file__), ".."))
+
+from snakemake.workflow import Workflow
+from snakemake.dag import DAG
+from snakemake.scheduler import JobScheduler
+from snakemake.jobtable import JobTable
+from snakemake.executors import CPUExecutor, AsyncCPUExecutor
+from snakemake.persistence import Persistence
+
+__author__ = "Johannes Köster"
+
+SCRIPTPATH = join(os.path.dirname(__file__), "../bin/snakemake")
+
+
+def fanin_snakefile(samples, steps):
+	"""
+	A workflow with a chain of steps per sample that is gathered by a
+	single job at the end.
+	"""
+	rules = ['SAMPLES = range({})\n'.format(samples)]
+	rules.append(
+		'rule all:\n'
+		'\tinput: expand("step{}/{{sample}}.txt", sample=SAMPLES)\n'
+		'\toutput: "gathered.txt"\n'
+		'\tshell: "touch {{output}}"\n'.format(steps - 1))
+	rules.append(
+		'rule step0:\n'
+		'\toutput: "step0/{sample}.txt"\n'
+		'\tshell: "touch {output}"\n')
+	for i in range(1, steps):
+		rules.append(
+			'rule step{i}:\n'
+			'\tinput: "step{j}/{{sample}}.txt"\n'
+			'\toutput: "step{i}/{{sample}}.txt"\n'
+			'\tshell: "touch {{output}}"\n'.format(i=i, j=i - 1))
+	return "\n".join(rules)
+
+
+def chain_snakefile(steps):
+	""" A sequential workflow of the given number of steps. """
+	return (
+		'rule all:\n'
+		'\tinput: "chain/{}.txt"\n\n'
+		'rule step:\n'
+		'\tinput: lambda wildcards: "chain/{{}}.txt".format(int(wildcards.i) - 1) '
+		'if int(wildcards.i) > 0 else []\n'
+		'\toutput: "chain/{{i,[0-9]+}}.txt"\n'
+		'\tshell: "touch {{output}}"\n'.format(steps - 1))
+
+
+def dynamic_snakefile(scatters, samples):
+	"""
+	A workflow with the given number of scatter rules with dynamic output
+	(each rule can only have a single job with dynamic output), next to a
+	fan-in over the given number of samples.
+	"""
+	rules = [fanin_snakefile(samples, 2).replace(
+		'sample=SAMPLES)\n',
+		'sample=SAMPLES), expand("gathered{{i}}.txt", i=range({}))\n'.format(
+			scatters))]
+	for i in range(scatters):
+		rules.append(
+			'rule scatter{i}:\n'
+			'\toutput: dynamic("scatter{i}/{{part}}.txt")\n'
+			'\tshell: "touch {{output}}"\n\n'
+			'rule process{i}:\n'
+			'\tinput: "scatter{i}/{{part}}.txt"\n'
+			'\toutput: "processed{i}/{{part}}.txt"\n'
+			'\tshell: "touch {{output}}"\n\n'
+			'rule gather{i}:\n'
+			'\tinput: dynamic("processed{i}/{{part}}.txt")\n'
+			'\toutput: "gathered{i}.txt"\n'
+			'\tshell: "touch {{output}}"\n'.format(i=i))
+	return "\n".join(rules)
+
+
+def build_dag(snakefile_content, **kwargs):
+	"""
+	Build the DAG of the given workflow in a temporary directory and
+	return it together with the temporary directory.
+	"""
+	tmpdir = mkdtemp()
+	snakefile = join(tmpdir, "Snakefile")
+	with open(snakefile, "w") as f:
+		f.write(snakefile_content)
+	os.chdir(tmpdir)
+	workflow = Workflow(snakefile=snakefile, snakemakepath=SCRIPTPATH)
+	workflow.include(snakefile, overwrite_first_rule=True)
+	workflow.check()
+	workflow.global_resources = dict(_cores=1)
+	dag = DAG(
+		workflow, dryrun=True, targetfiles=set(),
+		targetrules={workflow.get_rule(workflow.first_rule)},
+		priorityfiles=set(), priorityrules=set(), **kwargs)
+	dag.init()
+	dag.check_dynamic()
+	dag.postprocess()
+	return dag, tmpdir
+
+
+def measure(func):
+	""" Return the result, runtime and peak memory of calling func. """
+	tracemalloc.start()
+	start = time.time()
+	result = func()
+	runtime = time.time() - start
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return result, runtime, peak
+
+
+def report(name, **values):
+	print(name, *("{}={}".format(key, value)
+		for key, value in sorted(values.items())), sep="\t")
+
+
+def bench_dag_memory(samples=2000, steps=5):
+	olddir = os.getcwd()
+	(dag, tmpdir), runtime, peak = measure(
+		lambda: build_dag(fanin_snakefile(samples, steps)))
+	try:
+		graph = dag.graph
+		report(
+			"dag_memory", jobs=len(graph), edges=graph.edge_count,
+			build_seconds="{:.2f}".format(runtime),
+			peak_mb="{:.1f}".format(peak / 2 ** 20))
+	finally:
+		os.chdir(olddir)
+		call(['rm', '-rf', tmpdir])
+
+
+def bench_traversal(samples=2000, steps=5, repeat=10):
+	olddir = os.getcwd()
+	dag, tmpdir = build_dag(fanin_snakefile(samples, steps))
+	try:
+		start = time.time()
+		for _ in range(repeat):
+			for _ in dag.bfs(dag.dependencies, *dag.targetjobs):
+				pass
+		bfs = (time.time() - start) / repeat
+		start = time.time()
+		for _ in range(repeat):
+			for _ in dag.dfs(dag.dependencies, *dag.targetjobs):
+				pass
+		dfs = (time.time() - start) / repeat
+		report(
+			"traversal", jobs=len(dag.graph),
+			bfs_seconds="{:.4f}".format(bfs),
+			dfs_seconds="{:.4f}".format(dfs))
+	finally:
+		os.chdir(olddir)
+		call(['rm', '-rf', tmpdir])
+
+
+def bench_chain(steps=5000):
+	olddir = os.getcwd()
+	start = time.time()
+	dag, tmpdir = build_dag(chain_snakefile(steps))
+	try:
+		report(
+			"chain", jobs=len(dag.graph),
+			build_seconds="{:.2f}".format(time.time() - start))
+	finally:
+		os.chdir(olddir)
+		call(['rm', '-rf', tmpdir])
+
+
+def bench_dynamic(scatters=100, parts=20, samples=2000):
+	olddir = os.getcwd()
+	dag, tmpdir = build_dag(dynamic_snakefile(scatters, samples))
+	try:
+		jobs = [job for job in dag.ready_jobs if job.dynamic_output]
+		start = time.time()
+		for job in jobs:
+			os.makedirs(job.rule.name)
+			for part in range(parts):
+				open(join(job.rule.name, "{}.txt".format(part)), "w").close()
+			dag.finish(job)
+		report(
+			"dynamic", expansions=len(jobs), jobs=len(dag),
+			update_seconds="{:.2f}".format(time.time() - start))
+	finally:
+		os.chdir(olddir)
+		call(['rm', '-rf', tmpdir])
+
+
+def bench_scheduler(samples=2000, steps=2, cores=4):
+	olddir = os.getcwd()
+	dag, tmpdir = build_dag(fanin_snakefile(samples, steps))
+	try:
+		dag.workflow.global_resources = dict(_cores=cores)
+		scheduler = JobScheduler(
+			dag.workflow, dag, cores, dryrun=True, quiet=True)
+		start = time.time()
+		scheduler.schedule()
+		report(
+			"scheduler", jobs=len(dag),
+			schedule_seconds="{:.2f}".format(time.time() - start),
+			overhead_ms="{:.3f}".format(scheduler.overhead * 1000))
+	finally:
+		os.chdir(olddir)
+		call(['rm', '-rf', tmpdir])
+
+
+def bench_selection(jobs=100000, rules=50, resources=10, capacity=64):
+	names = ["_cores"] + ["res{}".format(i) for i in range(resources - 1)]
+
+	class Job:
+		def __init__(self, rule):
+			self.rule = rule
+			self.resources = {name: 1 for name in names}
+
+	for use_numpy in (True, False):
+		table = JobTable(names, use_numpy=use_numpy)
+		for i in range(jobs):
+			table.add(Job(i % rules), i % 5, i % 100)
+		start = time.time()
+		selected, _ = table.select([capacity] * resources)
+		report(
+			"selection", numpy=use_numpy, jobs=jobs, resources=resources,
+			selected=len(selected),
+			select_ms="{:.1f}".format((time.time() - start) * 1000))
+
+
+def run_jobs(executor, jobs, cores):
+	"""
+	Run the given jobs with the executor, keeping the given number of cores
+	busy like the scheduler does. Return the runtime.
+	"""
+	pending = list(jobs)
+	lock = threading.Lock()
+	finished = threading.Semaphore(0)
+
+	def run_next(job=None):
+		if job is not None:
+			finished.release()
+		with lock:
+			if not pending:
+				return
+			job = pending.pop()
+		executor.run(
+			job, callback=run_next, error_callback=run_next)
+
+	start = time.time()
+	for _ in range(cores):
+		run_next()
+	for _ in jobs:
+		finished.acquire()
+	runtime = time.time() - start
+	executor.shutdown()
+	return runtime
+
+
+def bench_spawn(samples=1000, cores=8):
+	"""
+	Run tiny shell jobs, keeping the given number of cores busy like the
+	scheduler does.
+	"""
+	for executor in (CPUExecutor, AsyncCPUExecutor):
+		olddir = os.getcwd()
+		dag, tmpdir = build_dag(fanin_snakefile(samples, 1))
+		try:
+			dag.workflow.persistence = Persistence(nolock=True, dag=dag)
+			executor = executor(
+				dag.workflow, dag, cores, quiet=True, output_wait=0)
+			jobs = [job for job in dag.ready_jobs if job.rule.name == "step0"]
+			runtime = run_jobs(executor, jobs, cores)
+			report(
+				"spawn", executor=type(executor).__name__, jobs=len(jobs),
+				seconds="{:.2f}".format(runtime),
+				ms_per_job="{:.3f}".format(runtime / len(jobs) * 1000))
+		finally:
+			os.chdir(olddir)
+			call(['rm', '-rf', tmpdir])
+
+
+def bench_workers(samples=1000, cores=8, max_jobs=100):
+	"""
+	Run tiny jobs with a run block that imports a module, in the process
+	pool and in warm workers that preload the module and are replaced after
+	max_jobs jobs.
+	"""
+	snakefile = fanin_snakefile(samples, 1).replace(
+		'\toutput: "step0/{sample}.txt"\n'
+		'\tshell: "touch {output}"\n',
+		'\toutput: "step0/{sample}.txt"\n'
+		'\tpreload: "xml.dom.minidom"\n'
+		'\trun:\n'
+		'\t\timport xml.dom.minidom\n'
+		'\t\topen(output[0], "w").close()\n')
+	for warm in (False, True):
+		olddir = os.getcwd()
+		dag, tmpdir = build_dag(snakefile)
+		try:
+			dag.workflow.persistence = Persistence(nolock=True, dag=dag)
+			executor = CPUExecutor(
+				dag.workflow, dag, cores, quiet=True, output_wait=0,
+				warm_workers=warm, max_jobs_per_worker=max_jobs)
+			jobs = [job for job in dag.ready_jobs if job.rule.name == "step0"]
+			runtime = run_jobs(executor, jobs, cores)
+			report(
+				"workers", warm=warm, jobs=len(jobs),
+				seconds="{:.2f}".format(runtime),
+				ms_per_job="{:.3f}".format(runtime / len(jobs) * 1000))
+		finally:
+			os.chdir(olddir)
+			call(['rm', '-rf', tmpdir])
+
+if __name__ == "__main__":
+	names = sys.argv[1:] or sorted(
+		name[6:] for name in dir() if name.startswith("bench_"))
+	for name in names:
+		globals()["bench_" + name]()
@@ -4,7 +4,12 @@ from os.path import join
 from subprocess import call
 from tempfile import mkdtemp
 import hashlib
-from snakemake import snakemake
+import pickle
+import random
+from snakemake import snakemake, execute_job
+from snakemake.dag import DAG
+from snakemake.io import Params, Wildcards, Resources
+from snakemake.jobtable import JobTable, knapsack
 
 __author__ = "Tobias Marschall, Marcel Martin"
 
@@ -121,3 +126,240 @@ def test_subworkflows():
 
 def test_globwildcards():
     run(dpath("test_globwildcards"))
+
+def test_dag_cache():
+	path = dpath("test_dag_cache")
+	tmpdir = mkdtemp()
+	cached_run = lambda: snakemake(join(tmpdir, "Snakefile"), workdir=tmpdir, snakemakepath=SCRIPTPATH, dag_cache=True)
+	result = lambda: open(join(tmpdir, "test.out")).read().strip()
+	# record whether the cached DAG was used
+	loaded = list()
+	load_cache = DAG.load_cache
+	def recording_load_cache(dag):
+		loaded.append(load_cache(dag))
+		return loaded[-1]
+	DAG.load_cache = recording_load_cache
+	try:
+		call('cp `find {} -maxdepth 1 -type f` {}'.format(path, tmpdir), shell=True)
+		assert cached_run()
+		assert result() == "in"
+		assert loaded == [False]
+		assert os.listdir(join(tmpdir, ".snakemake", "dag_cache"))
+		# the cached DAG is reused
+		os.remove(join(tmpdir, "test.out"))
+		assert cached_run()
+		assert result() == "in"
+		assert loaded[-1]
+		# the cached DAG is invalidated since test.in can be produced now
+		with open(join(tmpdir, "test.raw"), "w") as f:
+			print("raw", file=f)
+		os.remove(join(tmpdir, "test.out"))
+		assert cached_run()
+		assert result() == "raw"
+		assert not loaded[-1]
+		os.remove(join(tmpdir, "test.out"))
+		assert cached_run()
+		assert loaded[-1]
+		# the cached DAG is invalidated since the Snakefile changed
+		with open(join(tmpdir, "Snakefile"), "a") as f:
+			print("\nrule other:\n\toutput: \"other.txt\"\n\tshell: \"touch {output}\"", file=f)
+		os.remove(join(tmpdir, "test.out"))
+		assert cached_run()
+		assert result() == "raw"
+		assert not loaded[-1]
+	finally:
+		DAG.load_cache = load_cache
+		call(['rm', '-rf', tmpdir])
+
+
+def test_coalesce_window():
+	run(dpath("test05"), coalesce_window=0.1)
+
+def test_async_shell():
+	run(dpath("test05"), async_shell=True)
+
+def test_recursive():
+	run(dpath("test_recursive"))
+
+def test_failed_output():
+	# the partial output of failed jobs is removed
+	tmpdir = mkdtemp()
+	try:
+		snakefile = join(tmpdir, "Snakefile")
+		call(['cp', join(dpath("test_failed_output"), "Snakefile"), snakefile])
+		assert not snakemake(
+			snakefile, workdir=tmpdir, keepgoing=True,
+			snakemakepath=SCRIPTPATH), "expected error on execution"
+		for f in ("shell.txt", "run.txt"):
+			assert not os.path.exists(join(tmpdir, f)), \
+				'partial output "{}" not removed'.format(f)
+	finally:
+		call(['rm', '-rf', tmpdir])
+
+
+def test_execute_job():
+	# jobs are executed from a payload in the workdir of the job
+	path = dpath("test_execute_job")
+	tmpdir = mkdtemp()
+	olddir = os.getcwd()
+	def execute(rule, input, output):
+		payload = join(tmpdir, "{}.payload".format(rule))
+		with open(payload, "wb") as f:
+			pickle.dump(dict(
+				snakefile=join(tmpdir, "Snakefile"), workdir=tmpdir,
+				rule=rule, input=input, output=output, params=Params(),
+				wildcards=Wildcards(), threads=1,
+				resources=Resources(fromdict={"_cores": 1}), log=None), f)
+		return execute_job(payload, snakemakepath=SCRIPTPATH)
+	try:
+		call('cp `find {} -maxdepth 1 -type f` {}'.format(path, tmpdir), shell=True)
+		assert execute("copy", ["test.in"], ["test.out"])
+		with open(join(tmpdir, "test.out")) as f:
+			assert f.read().strip() == "in"
+		# the workdir directive is suppressed
+		assert not os.path.exists(join(tmpdir, "nested"))
+		# the output of a failed job is removed
+		assert not execute("fail", [], ["failed.out"])
+		assert not os.path.exists(join(tmpdir, "failed.out"))
+	finally:
+		os.chdir(olddir)
+		call(['rm', '-rf', tmpdir])
+
+
+def test_critical_path():
+	run(dpath("test_critical_path"))
+
+def test_backfill():
+	run(dpath("test_backfill"), backfill=True)
+
+def test_backfill_reservation():
+	run(dpath("test_backfill_reservation"), backfill=True)
+
+def test_resource_usage():
+	run(dpath("test_resource_usage"), mem_budget=1000, io_budget=1000)
+
+
+def test_cluster_notify():
+	run(dpath("test_cluster_notify"), cluster="./qsub", cluster_notify=True)
+
+
+def test_cluster_array():
+	run(
+		dpath("test_cluster_array"), cluster="./qsub {tasks}",
+		cluster_array="TASK_ID")
+
+
+def test_preload():
+	run(dpath("test_preload"), warm_workers=True, max_jobs_per_worker=2)
+
+
+class TableJob:
+	""" Job with a rule and resources, as needed by the JobTable. """
+
+	def __init__(self, name, rule, **resources):
+		self.name = name
+		self.rule = rule
+		self.resources = resources
+
+	def __repr__(self):
+		return self.name
+
+
+def random_tables(rnd, resources=("_cores", "mem")):
+	"""
+	Return a NumPy and a pure Python JobTable with the same random jobs,
+	some of them removed again.
+	"""
+	tables = [JobTable(resources, use_numpy=use_numpy)
+		for use_numpy in (True, False)]
+	rules = {
+		"rule{}".format(k): {name: rnd.randint(0, 4) for name in resources}
+		for k in range(rnd.randint(1, 5))}
+	jobs = list()
+	for k in range(rnd.randint(0, 40)):
+		rule = rnd.choice(sorted(rules))
+		jobs.append(TableJob("job{}".format(k), rule, **rules[rule]))
+	for job in jobs:
+		args = (rnd.randint(0, 3), rnd.randint(0, 10))
+		kwargs = dict(rank=rnd.randint(0, 5), dynamic=rnd.random() < 0.1)
+		inputsize = rnd.randint(0, 100) if rnd.random() < 0.5 else None
+		for table in tables:
+			table.add(job, *args, **kwargs)
+			if inputsize is not None:
+				table.set_inputsize(job, inputsize)
+	for job in rnd.sample(jobs, len(jobs) // 3):
+		for table in tables:
+			table.remove(job)
+	for job in rnd.sample(jobs, len(jobs) // 5):
+		for table in tables:
+			table.disable(job)
+	return tables, jobs
+
+
+def test_jobtable_select():
+	# the vectorized and the pure Python selection agree
+	rnd = random.Random(0)
+	for _ in range(200):
+		tables, jobs = random_tables(rnd)
+		capacities = [rnd.randint(0, 10), rnd.randint(0, 10)]
+		kwargs = dict(
+			maxcores=rnd.choice([None, 2]), inputsize=rnd.random() < 0.5,
+			dynamic=rnd.random() < 0.5,
+			jobs=rnd.sample(jobs, len(jobs) // 2)
+				if rnd.random() < 0.3 else None)
+		results = [table.select(capacities, **kwargs) for table in tables]
+		assert results[0][0] == results[1][0]
+		assert list(results[0][1]) == list(results[1][1])
+		assert tables[0].first(dynamic=kwargs["dynamic"]) is \
+			tables[1].first(dynamic=kwargs["dynamic"])
+	for use_numpy in (True, False):
+		table = JobTable(["_cores"], use_numpy=use_numpy)
+		jobs = [TableJob("wide", "wide", _cores=3),
+			TableJob("narrow1", "narrow", _cores=1),
+			TableJob("narrow2", "narrow", _cores=1)]
+		for job, priority in zip(jobs, (1, 0, 0)):
+			table.add(job, priority, 0)
+		assert table.first() is jobs[0]
+		# the jobs of the wide rule are rewarded with their priority
+		assert table.select([3]) == ([jobs[0]], [0])
+		assert table.select([2]) == (jobs[1:], [0])
+
+
+def test_jobtable_rows():
+	# rows stay consistent when removing and adding jobs after growing
+	for use_numpy in (True, False):
+		table = JobTable(["_cores", "mem"], use_numpy=use_numpy)
+		jobs = [
+			TableJob("job{}".format(k), "rule{}".format(k % 3), _cores=k % 4,
+				mem=k)
+			for k in range(50)]
+		for k, job in enumerate(jobs):
+			table.add(job, 0, k)
+		for job in jobs[::3]:
+			table.remove(job)
+			table.remove(job)
+		for k, job in enumerate(jobs[:20]):
+			table.add(job, 1, 0, rank=k)
+		contained = jobs[:20] + [
+			job for k, job in enumerate(jobs[20:], 20) if k % 3]
+		assert len(table) == len(contained)
+		assert sorted(table.selectable(), key=jobs.index) == contained
+		for job in contained:
+			assert job in table
+			assert table.requirements(job) == [
+				job.resources["_cores"], job.resources["mem"]]
+		assert all(job not in table for job in jobs[21::3])
+		assert table.first() is jobs[19]
+
+
+def test_knapsack():
+	rnd = random.Random(0)
+	for _ in range(200):
+		n = rnd.randint(0, 8)
+		weights = [rnd.randint(1, 5) for _ in range(n)]
+		values = [(rnd.randint(0, 3), rnd.randint(0, 3)) for _ in range(n)]
+		capacity = rnd.randint(0, 12)
+		solutions = [sorted(knapsack(weights, values, capacity, use_numpy))
+			for use_numpy in (True, False)]
+		assert solutions[0] == solutions[1]
+		assert sum(weights[i] for i in solutions[0]) <= capacity